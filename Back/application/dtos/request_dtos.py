@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 
 class ManualPoint(BaseModel):
     lat: float
@@ -7,9 +7,14 @@ class ManualPoint(BaseModel):
     name: str = "Manual Point"
 
 class OptimizeRequest(BaseModel):
-    n_clusters: int = 5
+    n_clusters: Union[int, str] = 5
     method: str = 'auto'
     use_csv: bool = False
     date_filter: Optional[str] = None
     manual_points: Optional[List[ManualPoint]] = None
     max_points: int = 50
+    spatial_sort: bool = False
+    time_budget_ms: Optional[float] = None
+    metric: str = 'haversine'
+    clustering_backend: str = 'kmeans'
+    max_cluster_size: Optional[int] = None
@@ -17,6 +17,17 @@ class StatsResponse(BaseModel):
     n_points: int
     n_clusters: int
     warning: Optional[str] = None
+    timed_out: bool = False
+    cache_hits: int = 0
+    cache_misses: int = 0
+    metric: str = 'haversine'
+    metric_max_rel_error: float = 0.0
+    clustering_backend: str = 'kmeans'
+    clustering_inertia: float = 0.0
+    n_clusters_auto: bool = False
+    predicted_tsp_time: Optional[float] = None
+    # 'hit', 'warm' or 'miss' in the fitted-model registry, None when streamed
+    clustering_registry: Optional[str] = None
 
 class OptimizeResponse(BaseModel):
     status: str
@@ -1,7 +1,9 @@
 import pandas as pd
 import numpy as np
 from typing import Tuple, List, Optional
-from geopy.distance import geodesic
+from scipy.spatial.distance import cdist
+
+from domain.services.geodesic import geodesic_matrix
 
 
 class DatasetProcessor:
@@ -206,26 +208,15 @@ class DatasetProcessor:
             raise ValueError("No hay coordenadas cargadas")
 
         n = len(self.coordenadas)
-        matriz = np.zeros((n, n))
 
         print(f"Calculando matriz de distancias ({n}x{n})...")
 
-        for i in range(n):
-            for j in range(i + 1, n):
-                if usar_geodesica:
-                    # Distancia geodésica en kilómetros
-                    dist = geodesic(
-                        self.coordenadas[i],
-                        self.coordenadas[j]
-                    ).kilometers
-                else:
-                    # Distancia euclidiana
-                    dist = np.linalg.norm(
-                        self.coordenadas[i] - self.coordenadas[j]
-                    )
-
-                matriz[i, j] = dist
-                matriz[j, i] = dist
+        if usar_geodesica:
+            # Distancia geodésica en kilómetros (elipsoide WGS-84, vectorizada por bloques)
+            matriz = geodesic_matrix(self.coordenadas)
+        else:
+            # Distancia euclidiana
+            matriz = cdist(self.coordenadas, self.coordenadas)
 
         print(f"Matriz calculada")
 
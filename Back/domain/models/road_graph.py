@@ -0,0 +1,20 @@
+from dataclasses import dataclass
+import numpy as np
+
+@dataclass
+class RoadGraph:
+    # Undirected road network in CSR form; row i lists the edges of node i.
+    # node_coords[i] is the (lat, lon) of node i, weights are in km.
+    node_ids: np.ndarray
+    node_coords: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
@@ -0,0 +1,100 @@
+"""
+Candidate graph
+The k nearest neighbours of every point, built once per point set and shared
+by the solvers: local search moves, greedy edge matching, the MST and the
+nearest neighbour walk only ever look at these edges. CSR-like layout, the
+neighbours of i are indices[indptr[i]:indptr[i + 1]], closest first.
+"""
+
+import numpy as np
+from typing import Tuple
+from scipy.spatial import cKDTree
+
+from domain.services.spatial_index import to_unit_vectors, chord_to_km
+
+
+class CandidateGraph:
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, distances: np.ndarray):
+        self.indptr = indptr
+        self.indices = indices
+        # Distances in km (same units as the distance matrices)
+        self.distances = distances
+
+    @classmethod
+    def _from_rows(cls, nearest: np.ndarray, dists: np.ndarray) -> 'CandidateGraph':
+        n, k = nearest.shape
+        indptr = np.arange(n + 1, dtype=np.int64) * k
+        return cls(indptr, nearest.ravel().astype(np.int64), dists.ravel().astype(np.float64))
+
+    @classmethod
+    def from_points(cls, points: np.ndarray, k: int = 10, to_km=None) -> 'CandidateGraph':
+        # KD-tree neighbours under plain Euclidean distance; to_km converts
+        # the tree distances when the points are not already in km
+        n = len(points)
+        k = max(0, min(k, n - 1))
+        if k == 0:
+            return cls._from_rows(np.empty((n, 0), dtype=np.int64), np.empty((n, 0)))
+        # One extra for the point itself; with duplicates it may not come
+        # first, so move it to the end before keeping k
+        dists, nearest = cKDTree(points).query(points, k=k + 1)
+        is_self = nearest == np.arange(n)[:, np.newaxis]
+        order = np.argsort(is_self, axis=1, kind='stable')[:, :k]
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        dists = np.take_along_axis(dists, order, axis=1)
+        return cls._from_rows(nearest, to_km(dists) if to_km is not None else dists)
+
+    @classmethod
+    def from_coordinates(cls, coordinates: np.ndarray, k: int = 10) -> 'CandidateGraph':
+        # KD-tree over unit vectors: chord order is great-circle order, so these
+        # are the haversine nearest neighbours in O(n log n)
+        return cls.from_points(to_unit_vectors(coordinates), k, to_km=chord_to_km)
+
+    @classmethod
+    def from_distance_matrix(cls, dist_matrix, k: int = 10) -> 'CandidateGraph':
+        # Exact neighbours of an arbitrary (e.g. road) matrix, dense or
+        # condensed, read in row blocks to keep the temporaries small
+        n = len(dist_matrix)
+        k = max(0, min(k, n - 1))
+        nearest = np.empty((n, k), dtype=np.int64)
+        dists = np.empty((n, k))
+        if k == 0:
+            return cls._from_rows(nearest, dists)
+        block = max(1, (1 << 22) // n)
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            masked = np.array(dist_matrix[start:stop], dtype=np.float64)
+            masked[np.arange(stop - start), np.arange(start, stop)] = np.inf
+            part = np.argpartition(masked, k - 1, axis=1)[:, :k]
+            part_dists = np.take_along_axis(masked, part, axis=1)
+            order = np.argsort(part_dists, axis=1, kind='stable')
+            nearest[start:stop] = np.take_along_axis(part, order, axis=1)
+            dists[start:stop] = np.take_along_axis(part_dists, order, axis=1)
+        return cls._from_rows(nearest, dists)
+
+    @property
+    def n(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def k(self) -> int:
+        return int(self.indptr[1] - self.indptr[0]) if self.n else 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + self.distances.nbytes
+
+    def setflags(self, write: bool):
+        for arr in (self.indptr, self.indices, self.distances):
+            arr.setflags(write=write)
+
+    def neighbors(self, i: int) -> np.ndarray:
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def as_array(self) -> np.ndarray:
+        # n x k view of the neighbour lists (every row has k entries)
+        return self.indices.reshape(self.n, self.k)
+
+    def edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Directed edge list (rows, cols, km)
+        rows = np.repeat(np.arange(self.n), np.diff(self.indptr))
+        return rows, self.indices, self.distances
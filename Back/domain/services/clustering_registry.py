@@ -0,0 +1,87 @@
+"""
+Registry of fitted K-Means models
+Fitted clusterings are kept by dataset fingerprint and configuration (k,
+backend, seed, ...). The exact same point set gets its centroids and labels
+back without any fitting; a point set that shares most of its points with a
+registered one starts K-Means from that one's centroids with a single init.
+"""
+
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from domain.services.tsp_cache import TSPCache
+
+
+class KMeansRegistry:
+    def __init__(self, max_entries: int = 64, min_overlap: float = 0.9):
+        self.max_entries = max_entries
+        # Share of points two sets must have in common for a warm start
+        self.min_overlap = min_overlap
+        self.hits = 0
+        self.warm_starts = 0
+        self.misses = 0
+        # (fingerprint, config) -> (row hashes, fitted result)
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def fingerprint(coordinates: np.ndarray) -> str:
+        # Order matters: labels are per row
+        return TSPCache.make_key(coordinates, 'kmeans')
+
+    @staticmethod
+    def row_hashes(coordinates: np.ndarray) -> np.ndarray:
+        # One 64-bit hash per point, sorted, to measure overlap between sets
+        coords = np.ascontiguousarray(coordinates, dtype=np.float64).reshape(len(coordinates), -1)
+        bits = coords.view(np.uint64)
+        mixed = np.zeros(len(coords), dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            for col in range(bits.shape[1]):
+                mixed = (mixed ^ bits[:, col]) * np.uint64(0x100000001B3)
+                mixed ^= mixed >> np.uint64(29)
+        return np.unique(mixed)
+
+    def lookup(self, coordinates: np.ndarray, config: Tuple) -> Tuple[str, Optional[Any]]:
+        # ('hit', result) for the same point set, ('warm', result of the
+        # closest similar set fitted with the same config) to start from its
+        # centroids, ('miss', None) otherwise
+        key = (self.fingerprint(coordinates), config)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return 'hit', entry[1]
+
+        hashes = self.row_hashes(coordinates)
+        best, best_overlap = None, 0.0
+        for (_, other_config), (other_hashes, result) in reversed(self._entries.items()):
+            if other_config != config:
+                continue
+            common = len(np.intersect1d(hashes, other_hashes, assume_unique=True))
+            overlap = common / max(len(hashes), len(other_hashes), 1)
+            if overlap > best_overlap:
+                best, best_overlap = result, overlap
+        if best is not None and best_overlap >= self.min_overlap:
+            self.warm_starts += 1
+            return 'warm', best
+
+        self.misses += 1
+        return 'miss', None
+
+    def store(self, coordinates: np.ndarray, config: Tuple, result: Dict[str, Any]):
+        key = (self.fingerprint(coordinates), config)
+        self._entries[key] = (self.row_hashes(coordinates), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'warm_starts': self.warm_starts,
+            'misses': self.misses,
+            'entries': len(self._entries),
+        }
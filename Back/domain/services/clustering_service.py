@@ -4,33 +4,444 @@ Refactored for DDD
 """
 
 import numpy as np
-from typing import List, Tuple, Dict, Any
-from sklearn.cluster import KMeans
+from typing import List, Tuple, Dict, Any, Iterable, Optional, Union
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from scipy.spatial import cKDTree
+import math
 import time
 
+from domain.services.spatial_index import equirectangular_points, euclidean_mst
+from domain.services.runtime_model import SolverRuntimeModel
+from domain.services.clustering_registry import KMeansRegistry
+
 class ClusteringService:
-    def __init__(self, n_clusters: int = 5, random_state: int = 42):
+    # 'kmeans': full Lloyd K-Means, best of 10 inits. 'minibatch': MiniBatch
+    # K-Means on float32, k-means++ seeded from a sample of init_size points,
+    # and the only backend that can be fed chunk by chunk (fit_stream)
+    BACKENDS = ('kmeans', 'minibatch')
+    # Optimal tour / MST length ratio for random uniform points
+    # (0.7124 / 0.6331, Beardwood-Halton-Hammersley constants)
+    TOUR_PER_MST = 1.125
+
+    def __init__(self, n_clusters: Union[int, str] = 5, random_state: int = 42,
+                 clustering_backend: str = 'kmeans', batch_size: int = 4096,
+                 init_size: Optional[int] = None, max_cluster_size: Optional[int] = None,
+                 balance_iterations: int = 10, runtime_model: Optional[SolverRuntimeModel] = None,
+                 latency_budget_ms: float = 1000.0, max_auto_clusters: int = 64,
+                 registry: Optional[KMeansRegistry] = None):
+        if clustering_backend not in self.BACKENDS:
+            raise ValueError(f"Unknown clustering backend '{clustering_backend}', expected one of {self.BACKENDS}")
+        if max_cluster_size is not None and max_cluster_size < 1:
+            raise ValueError(f"max_cluster_size must be at least 1, got {max_cluster_size}")
+        if isinstance(n_clusters, str) and n_clusters != 'auto':
+            raise ValueError(f"n_clusters must be an integer or 'auto', got '{n_clusters}'")
+        # 'auto': the k with the shortest predicted tour whose predicted TSP
+        # time (runtime_model, summed over the clusters) fits latency_budget_ms.
+        # Becomes the chosen integer once fitted; the search is in self.selection
+        self.auto = n_clusters == 'auto'
         self.n_clusters = n_clusters
+        self.runtime_model = runtime_model
+        self.latency_budget_ms = latency_budget_ms
+        self.max_auto_clusters = max_auto_clusters
+        self.selection = None
+        # Fitted models shared across requests: 'hit' when this exact point
+        # set was already clustered, 'warm' when a similar one was (K-Means
+        # then starts from its centroids with a single init), else 'miss'
+        self.registry = registry
+        self.registry_status = None
+        # Balanced mode: no cluster gets more than max_cluster_size points
+        # (e.g. TSPService.EXACT_MAX_POINTS, so every cluster is solved
+        # exactly). n_clusters is raised to ceil(n / max_cluster_size) if needed.
+        self.max_cluster_size = max_cluster_size
+        self.balance_iterations = balance_iterations
+        self.n_reassigned = 0
         self.random_state = random_state
+        self.clustering_backend = clustering_backend
+        self.batch_size = batch_size
+        self.init_size = init_size
         self.model = None
         self.labels_ = None
         self.cluster_centers_ = None
+        self.inertia_ = None
+        self.fit_time = 0.0
+        self.n_batches = 0
 
-    def fit(self, coordinates: np.ndarray) -> 'ClusteringService':
-        self.model = KMeans(
+    def _minibatch_model(self, init: Optional[np.ndarray] = None) -> MiniBatchKMeans:
+        # With init (warm start from known centroids) a single run is enough
+        return MiniBatchKMeans(
             n_clusters=self.n_clusters,
             random_state=self.random_state,
-            n_init=10,
-            max_iter=300
+            batch_size=self.batch_size,
+            init='k-means++' if init is None else init.astype(np.float32),
+            # Default sample for the seeding is 3 * batch_size points
+            init_size=self.init_size,
+            n_init=3 if init is None else 1
         )
-        self.model.fit(coordinates)
+
+    def _fit_model(self, coordinates: np.ndarray, init: Optional[np.ndarray] = None):
+        if self.clustering_backend == 'minibatch':
+            self.model = self._minibatch_model(init)
+            self.model.fit(np.asarray(coordinates, dtype=np.float32))
+            self.n_batches = int(self.model.n_steps_)
+        else:
+            self.model = KMeans(
+                n_clusters=self.n_clusters,
+                random_state=self.random_state,
+                init='k-means++' if init is None else init,
+                n_init=10 if init is None else 1,
+                max_iter=300
+            )
+            self.model.fit(coordinates)
+            self.n_batches = 0
         self.labels_ = self.model.labels_
         self.cluster_centers_ = self.model.cluster_centers_
+        self.inertia_ = float(self.model.inertia_)
+
+    def _registry_config(self) -> Tuple:
+        # Everything besides the points that the fitted result depends on
+        config = ('auto' if self.auto else self.n_clusters, self.clustering_backend, self.random_state,
+                  self.max_cluster_size, self.balance_iterations, self.batch_size, self.init_size)
+        if self.auto:
+            model = self.runtime_model
+            config += (self.latency_budget_ms, self.max_auto_clusters,
+                       (model.method, model.tsp_service.metric) if model is not None else None)
+        return config
+
+    def _result(self) -> Dict[str, Any]:
+        return {
+            'model': self.model,
+            'n_clusters': self.n_clusters,
+            'labels': self.labels_,
+            'cluster_centers': self.cluster_centers_,
+            'inertia': self.inertia_,
+            'n_batches': self.n_batches,
+            'n_reassigned': self.n_reassigned,
+            'selection': self.selection,
+        }
+
+    def _restore(self, result: Dict[str, Any]):
+        self.model = result['model']
+        self.n_clusters = result['n_clusters']
+        self.labels_ = result['labels']
+        self.cluster_centers_ = result['cluster_centers']
+        self.inertia_ = result['inertia']
+        self.n_batches = result['n_batches']
+        self.n_reassigned = result['n_reassigned']
+        self.selection = result['selection']
+
+    def fit(self, coordinates: np.ndarray) -> 'ClusteringService':
+        start = time.time()
+        config = None
+        previous = None
+        if self.registry is not None:
+            config = self._registry_config()
+            self.registry_status, previous = self.registry.lookup(coordinates, config)
+            if self.registry_status == 'hit':
+                self._restore(previous)
+                self.fit_time = time.time() - start
+                return self
+
+        if self.max_cluster_size is not None and not self.auto:
+            self.n_clusters = max(self.n_clusters, math.ceil(len(coordinates) / self.max_cluster_size))
+        init = None
+        if previous is not None:
+            init = np.asarray(previous['cluster_centers'], dtype=np.float64)
+            if self.auto:
+                # Keep the k chosen for the similar set, skip the search, but
+                # never below the floor the size cap sets for this set
+                self.n_clusters = len(init)
+                if self.max_cluster_size is not None:
+                    self.n_clusters = max(self.n_clusters, math.ceil(len(coordinates) / self.max_cluster_size))
+                self.selection = previous['selection']
+            if len(init) < self.n_clusters:
+                # The cap asks for more clusters than the similar set had
+                init = self._extend_centers(np.asarray(coordinates, dtype=np.float64), init,
+                                            self.n_clusters - len(init),
+                                            np.random.default_rng(self.random_state))
+            elif len(init) > self.n_clusters:
+                # Fewer clusters than before: start from the most populated
+                members = np.bincount(previous['labels'], minlength=len(init))
+                init = init[np.sort(np.argsort(-members, kind='stable')[:self.n_clusters])]
+
+        if self.auto and init is None:
+            self._select_n_clusters(coordinates)
+        else:
+            self._fit_model(coordinates, init)
+        if self.max_cluster_size is not None:
+            self._balance(coordinates)
+
+        if self.registry is not None:
+            self.registry.store(coordinates, config, self._result())
+        self.fit_time = time.time() - start
+        return self
+
+    @staticmethod
+    def _extend_centers(points: np.ndarray, centers: np.ndarray, n_new: int, rng) -> np.ndarray:
+        # k-means++ seeding continued from existing centroids: each new one is
+        # a point drawn with probability proportional to its squared distance
+        # to the nearest centroid so far
+        d2 = cKDTree(centers).query(points)[0] ** 2
+        new = []
+        for _ in range(n_new):
+            total = d2.sum()
+            i = rng.choice(len(points), p=d2 / total) if total > 0 else rng.integers(len(points))
+            new.append(points[i])
+            offsets = points - points[i]
+            d2 = np.minimum(d2, np.einsum('ij,ij->i', offsets, offsets))
+        return np.vstack([centers] + new) if new else centers
+
+    def _select_n_clusters(self, coordinates: np.ndarray):
+        # Warm-started K-Means over a geometric grid of k: each fit starts
+        # from the previous centroids plus k-means++ seeds for the new ones.
+        # Every candidate is scored with the runtime model (predicted TSP time
+        # of its cluster sizes) and a tour length estimate: the MST edges of
+        # the whole point set inside each cluster, scaled by the expected
+        # quality of the solver that cluster size gets, plus the closed path
+        # through the centroids in label order, the order the router visits
+        # the clusters in.
+        points = np.asarray(coordinates, dtype=np.float64)
+        n = len(points)
+        if self.runtime_model is None:
+            from domain.services.tsp_service import TSPService
+            self.runtime_model = SolverRuntimeModel(TSPService())
+        budget = self.latency_budget_ms / 1000.0
+
+        k_lo = math.ceil(n / self.max_cluster_size) if self.max_cluster_size is not None else 1
+        k_lo = max(1, min(k_lo, n))
+        k_hi = max(k_lo, min(n, self.max_auto_clusters))
+        grid = sorted({min(k_hi, int(round(k_lo * 1.4 ** i)))
+                       for i in range(int(math.log(k_hi / k_lo, 1.4)) + 2)})
+
+        points_km = equirectangular_points(points)
+        mst = euclidean_mst(points_km).tocoo() if n > 1 else None
+        predicted_times: Dict[int, float] = {}
+        qualities: Dict[int, float] = {}
+        rng = np.random.default_rng(self.random_state)
+
+        candidates = []
+        fits = {}
+        centers = None
+        for k in grid:
+            self.n_clusters = k
+            init = None if centers is None else self._extend_centers(points, centers, k - len(centers), rng)
+            self._fit_model(points, init)
+            centers = np.asarray(self.cluster_centers_, dtype=np.float64)
+            labels = self.labels_
+
+            if self.max_cluster_size is not None:
+                # Balancing evens the sizes out
+                sizes = np.full(k, n // k) + (np.arange(k) < n % k)
+            else:
+                sizes = np.bincount(labels, minlength=k)
+            for size in np.unique(sizes):
+                if size not in predicted_times:
+                    predicted_times[size] = self.runtime_model.predict_time(int(size))
+                    qualities[size] = self.runtime_model.quality(int(size))
+            predicted_time = float(sum(predicted_times[size] for size in sizes))
+
+            length = 0.0
+            if mst is not None:
+                inside = labels[mst.row] == labels[mst.col]
+                intra = np.bincount(labels[mst.row[inside]], weights=mst.data[inside], minlength=k)
+                length = float(np.dot([qualities[size] for size in sizes], intra))
+                length *= self.TOUR_PER_MST
+                if k > 1:
+                    counts = np.bincount(labels, minlength=k)
+                    centroids_km = np.column_stack([np.bincount(labels, weights=points_km[:, d], minlength=k)
+                                                    for d in range(2)])[counts > 0] / counts[counts > 0, np.newaxis]
+                    hops = centroids_km - np.roll(centroids_km, -1, axis=0)
+                    length += float(np.sum(np.sqrt(np.einsum('ij,ij->i', hops, hops))))
+
+            candidates.append({'k': k, 'predicted_time': predicted_time, 'predicted_length': length})
+            fits[k] = (self.model, labels, self.cluster_centers_, self.inertia_, self.n_batches)
+
+        feasible = [c for c in candidates if c['predicted_time'] <= budget]
+        if feasible:
+            chosen = min(feasible, key=lambda c: (c['predicted_length'], c['k']))
+        else:
+            chosen = min(candidates, key=lambda c: (c['predicted_time'], c['k']))
+
+        self.n_clusters = chosen['k']
+        self.model, self.labels_, self.cluster_centers_, self.inertia_, self.n_batches = fits[chosen['k']]
+        self.selection = {
+            'n_clusters': chosen['k'],
+            'predicted_time': chosen['predicted_time'],
+            'predicted_length': chosen['predicted_length'],
+            'latency_budget_ms': self.latency_budget_ms,
+            'within_budget': bool(feasible),
+            'candidates': candidates,
+        }
+
+    def fit_stream(self, chunks: Iterable[np.ndarray]) -> 'ClusteringService':
+        # MiniBatch K-Means over chunks that never have to be in memory
+        # together (e.g. CSVRepository.iter_chunks). Labels are assigned
+        # later, by get_clusters, for whatever points the caller kept.
+        if self.clustering_backend != 'minibatch':
+            raise ValueError("fit_stream requires clustering_backend='minibatch'")
+        if self.auto:
+            raise ValueError("n_clusters='auto' needs every point in memory, use fit")
+        start = time.time()
+        self.model = self._minibatch_model()
+        self.n_batches = 0
+        # The first partial_fit seeds the centroids, so it needs at least
+        # n_clusters points: small leading chunks are held back until then
+        pending = []
+        n_pending = 0
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=np.float32).reshape(-1, 2)
+            if len(chunk) == 0:
+                continue
+            if self.n_batches == 0:
+                pending.append(chunk)
+                n_pending += len(chunk)
+                if n_pending < self.n_clusters:
+                    continue
+                chunk = np.vstack(pending)
+                pending = []
+            self.model.partial_fit(chunk)
+            self.n_batches += 1
+
+        if self.n_batches == 0:
+            if n_pending == 0:
+                raise ValueError("No points to cluster")
+            # Fewer points than clusters: one cluster per point
+            self.n_clusters = n_pending
+            self.model = self._minibatch_model()
+            self.model.partial_fit(np.vstack(pending))
+            self.n_batches = 1
+
+        self.cluster_centers_ = self.model.cluster_centers_
+        self.labels_ = None
+        self.inertia_ = None
+        self.fit_time = time.time() - start
         return self
 
+    def _assign(self, coordinates: np.ndarray):
+        # Nearest centroid of every point, and the inertia of that labelling
+        points = np.asarray(coordinates, dtype=np.float32)
+        self.labels_ = self.model.predict(points)
+        offsets = points - self.cluster_centers_[self.labels_]
+        self.inertia_ = float(np.sum(offsets.astype(np.float64) ** 2))
+
+    @staticmethod
+    def _capacitated_assignment(points: np.ndarray, centers: np.ndarray, capacity: int,
+                                n_candidates: int = 8, max_passes: int = 5) -> np.ndarray:
+        # Greedy regret: points are placed in decreasing order of the gap
+        # between their nearest and second nearest centroid, each into the
+        # closest of its candidate centroids that still has room, so the
+        # points with most to lose choose first. Points whose candidates are
+        # all full go to the nearest centroid with room left.
+        n, k = len(points), len(centers)
+        if k * capacity < n:
+            raise ValueError(f"{k} clusters of at most {capacity} points cannot hold {n} points")
+        m = min(k, n_candidates)
+        dists, nearest = cKDTree(centers).query(points, k=m)
+        dists = dists.reshape(n, m)
+        nearest = nearest.reshape(n, m)
+        regret = dists[:, 1] - dists[:, 0] if m > 1 else np.zeros(n)
+
+        labels = np.full(n, -1, dtype=np.int64)
+        room = np.full(k, capacity, dtype=np.int64)
+        overflow = []
+        for i in np.argsort(-regret, kind='stable'):
+            for j in nearest[i]:
+                if room[j] > 0:
+                    labels[i] = j
+                    room[j] -= 1
+                    break
+            else:
+                overflow.append(i)
+
+        for i in overflow:
+            open_clusters = np.flatnonzero(room > 0)
+            offsets = centers[open_clusters] - points[i]
+            j = open_clusters[np.argmin(np.einsum('ij,ij->i', offsets, offsets))]
+            labels[i] = j
+            room[j] -= 1
+
+        # Repair: a point outside its nearest centroid moves to a closer
+        # cluster with room, or swaps with the member of that cluster for
+        # which the exchange saves the most squared distance
+        members = [set(np.flatnonzero(labels == j).tolist()) for j in range(k)]
+        sq_dists = dists ** 2
+        for _ in range(max_passes):
+            changed = 0
+            for i in np.flatnonzero(labels != nearest[:, 0]):
+                a = labels[i]
+                offset = points[i] - centers[a]
+                cost_a = float(offset @ offset)
+                for c in range(m):
+                    b = nearest[i, c]
+                    if b == a or sq_dists[i, c] >= cost_a:
+                        break
+                    if room[b] > 0:
+                        members[a].remove(i)
+                        members[b].add(i)
+                        labels[i] = b
+                        room[a] += 1
+                        room[b] -= 1
+                        changed += 1
+                        break
+                    others = np.fromiter(members[b], dtype=np.int64)
+                    in_b = points[others] - centers[b]
+                    in_a = points[others] - centers[a]
+                    gain = (cost_a - sq_dists[i, c]) + np.einsum('ij,ij->i', in_b, in_b) \
+                        - np.einsum('ij,ij->i', in_a, in_a)
+                    best = int(np.argmax(gain))
+                    if gain[best] > 1e-12:
+                        j = int(others[best])
+                        members[a].remove(i)
+                        members[b].remove(j)
+                        members[a].add(j)
+                        members[b].add(i)
+                        labels[i], labels[j] = b, a
+                        changed += 1
+                        break
+            if not changed:
+                break
+        return labels
+
+    def _balance(self, coordinates: np.ndarray):
+        # Capacitated K-Means: alternate the capacitated assignment with
+        # centroid updates while the inertia keeps dropping
+        points = np.asarray(coordinates, dtype=np.float64)
+        centers = np.asarray(self.cluster_centers_, dtype=np.float64)
+        unconstrained = self.labels_
+
+        best_labels, best_centers, best_inertia = None, centers, float('inf')
+        for _ in range(max(1, self.balance_iterations)):
+            labels = self._capacitated_assignment(points, centers, self.max_cluster_size)
+            inertia = float(np.sum((points - centers[labels]) ** 2))
+            if inertia >= best_inertia:
+                break
+            best_labels, best_centers, best_inertia = labels, centers, inertia
+            # Empty clusters keep their centroid
+            sums = np.zeros_like(centers)
+            np.add.at(sums, labels, points)
+            counts = np.bincount(labels, minlength=len(centers))[:, np.newaxis]
+            centers = np.where(counts > 0, sums / np.maximum(counts, 1), centers)
+
+        self.n_reassigned = int(np.count_nonzero(best_labels != unconstrained)) if unconstrained is not None else 0
+        self.labels_ = best_labels
+        self.cluster_centers_ = best_centers
+        self.inertia_ = best_inertia
+
     def get_clusters(self, coordinates: np.ndarray, names: List[str]) -> List[Dict[str, Any]]:
-        if self.labels_ is None:
+        if self.model is None:
             self.fit(coordinates)
+        elif self.labels_ is None:
+            # Streamed fit: label the points now
+            start = time.time()
+            stream_time = self.fit_time
+            if self.max_cluster_size is not None and \
+                    self.n_clusters * self.max_cluster_size < len(coordinates):
+                # Too few clusters for the cap, refit on the kept points
+                self.fit(coordinates)
+            else:
+                self._assign(coordinates)
+                if self.max_cluster_size is not None:
+                    self._balance(coordinates)
+            self.fit_time = stream_time + time.time() - start
 
         clusters = []
         for i in range(self.n_clusters):
@@ -59,5 +470,13 @@ class ClusteringService:
         return {
             'n_clusters': self.n_clusters,
             'sizes': sizes,
-            'inertia': float(self.model.inertia_) if self.model else 0
+            'inertia': self.inertia_ if self.inertia_ is not None else 0,
+            'backend': self.clustering_backend,
+            'fit_time': self.fit_time,
+            'n_batches': self.n_batches,
+            'max_cluster_size': self.max_cluster_size,
+            'n_reassigned': self.n_reassigned,
+            'auto': self.auto,
+            'predicted_tsp_time': self.selection['predicted_time'] if self.selection else None,
+            'registry': self.registry_status
         }
@@ -0,0 +1,149 @@
+"""
+Road network distance backend
+Driving distances for TSPService from a RoadGraph: every point is snapped to
+its nearest road node and the cluster matrix is filled by one Dijkstra run
+per distinct node, split across worker processes. Large clusters get a
+condensed matrix filled a block of rows at a time.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Optional, Tuple
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from domain.models.road_graph import RoadGraph
+from domain.services.distance_matrix import CondensedDistanceMatrix
+from domain.services.spatial_index import to_unit_vectors, chord_to_km
+from domain.services.tsp_cache import TSPCache
+from domain.services.tsp_parallel import SharedMatrix, dijkstra_rows
+
+
+class RoadNetworkBackend:
+    name = 'road_network'
+
+    def __init__(self, graph: RoadGraph, n_workers: Optional[int] = None,
+                 parallel_min_sources: int = 32, snap_cache: Optional[TSPCache] = None):
+        self.graph = graph
+        self.n_workers = n_workers or os.cpu_count() or 1
+        # Below this many Dijkstra sources a process pool costs more than it saves
+        self.parallel_min_sources = parallel_min_sources
+        # Snapped node ids by point set; a repeated cluster skips the KD-tree
+        self.snap_cache = snap_cache or TSPCache(max_bytes=16 * 1024 * 1024)
+        self._tree = cKDTree(to_unit_vectors(graph.node_coords))
+        self._csr = csr_matrix((graph.weights, graph.indices, graph.indptr),
+                               shape=(graph.n_nodes, graph.n_nodes))
+        # Pairs with no road between them in the last matrix (haversine used)
+        self.last_unreachable = 0
+
+    def snap(self, coordinates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Nearest road node of each point and the straight-line km to reach it
+        key = TSPCache.make_key(coordinates, 'snap')
+        cached = self.snap_cache.get(key)
+        if cached is not None:
+            return cached
+        chord, nodes = self._tree.query(to_unit_vectors(np.asarray(coordinates, dtype=np.float64)))
+        snapped = (np.asarray(nodes, dtype=np.int64), chord_to_km(chord))
+        self.snap_cache.put(key, snapped, 16 * len(coordinates) + 256)
+        return snapped
+
+    def _node_distances(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        # len(sources) x len(targets) shortest path lengths between road nodes
+        if self.n_workers <= 1 or len(sources) < self.parallel_min_sources:
+            return dijkstra(self._csr, directed=False, indices=sources)[:, targets]
+
+        batches = np.array_split(sources, min(self.n_workers, len(sources)))
+        g = self.graph
+        with SharedMatrix(g.indptr) as indptr, SharedMatrix(g.indices) as indices, \
+                SharedMatrix(g.weights) as weights:
+            specs = [(shm.name, shm.shape, shm.dtype) for shm in (indptr, indices, weights)]
+            with ProcessPoolExecutor(max_workers=len(batches)) as pool:
+                blocks = list(pool.map(dijkstra_rows, [specs] * len(batches), [g.n_nodes] * len(batches),
+                                       batches, [targets] * len(batches)))
+        return np.vstack(blocks)
+
+    def _prepare(self, coordinates: np.ndarray):
+        # Snapped nodes, each point's slot among the distinct ones, snap legs
+        # and unit vectors for the straight-line fallback
+        nodes, offsets = self.snap(coordinates)
+        unique_nodes, slot = np.unique(nodes, return_inverse=True)
+        return unique_nodes, slot, offsets, to_unit_vectors(np.asarray(coordinates, dtype=np.float64))
+
+    def _block(self, prepared, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Snap leg + road path + snap leg between the rows and cols points,
+        # with one Dijkstra run per distinct road node of the rows. Points
+        # sharing a road node are joined by their straight-line distance
+        # instead of two snap legs. Also returns the pairs with no road.
+        unique_nodes, slot, offsets, units = prepared
+        sources = np.unique(slot[rows])
+        road = self._node_distances(unique_nodes[sources], unique_nodes[slot[cols]])
+        road = road[np.searchsorted(sources, slot[rows])]
+        block = offsets[rows, np.newaxis] + road + offsets[np.newaxis, cols]
+
+        straight = chord_to_km(cdist(units[rows], units[cols]))
+        unreachable = ~np.isfinite(road)
+        fallback = unreachable | (slot[rows, np.newaxis] == slot[np.newaxis, cols])
+        block[fallback] = straight[fallback]
+        block[rows[:, np.newaxis] == cols[np.newaxis, :]] = 0.0
+        return block, unreachable
+
+    def _edge_distances(self, prepared, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        # Same distances as _block, for the pairs (a[k], b[k]) only
+        unique_nodes, slot, offsets, units = prepared
+        sources = np.unique(slot[a])
+        road = self._node_distances(unique_nodes[sources], unique_nodes[slot[b]])
+        road = road[np.searchsorted(sources, slot[a]), np.arange(len(b))]
+        distances = offsets[a] + road + offsets[b]
+
+        straight = chord_to_km(np.sqrt(np.sum((units[a] - units[b])**2, axis=1)))
+        fallback = ~np.isfinite(road) | (slot[a] == slot[b])
+        distances[fallback] = straight[fallback]
+        distances[a == b] = 0.0
+        return distances
+
+    def route_length(self, coordinates: np.ndarray, route, block_size: int = 1 << 22) -> float:
+        # Road length of a closed route from its consecutive edges alone,
+        # a block of edges at a time (about block_size Dijkstra values), so
+        # a long route needs no N x N matrix
+        route = np.asarray(route, dtype=np.int64)
+        if len(route) < 2:
+            return 0.0
+        prepared = self._prepare(coordinates)
+        following = np.roll(route, -1)
+        step = max(1, block_size // max(self.graph.n_nodes, 1))
+        total = 0.0
+        for start in range(0, len(route), step):
+            total += float(np.sum(self._edge_distances(prepared, route[start:start + step],
+                                                       following[start:start + step])))
+        return total
+
+    def distance_matrix(self, coordinates: np.ndarray) -> np.ndarray:
+        points = np.arange(len(coordinates))
+        matrix, unreachable = self._block(self._prepare(coordinates), points, points)
+        self.last_unreachable = int(np.count_nonzero(unreachable) // 2)
+        return matrix
+
+    def condensed_matrix(self, coordinates: np.ndarray,
+                         deadline: Optional[float] = None) -> Optional[CondensedDistanceMatrix]:
+        # Upper triangle only, a block of source rows at a time, so neither
+        # the N x N matrix nor every Dijkstra row is held at once. Blocks are
+        # sized so each one's Dijkstra rows over the whole graph stay near
+        # the default block of values.
+        n = len(coordinates)
+        prepared = self._prepare(coordinates)
+        unreachable = 0
+
+        def rows(start, stop):
+            nonlocal unreachable
+            block, missing = self._block(prepared, np.arange(start, stop), np.arange(start, n))
+            unreachable += int(np.count_nonzero(np.triu(missing, 1)))
+            return block
+
+        block_size = (1 << 22) * n // max(n, self.graph.n_nodes)
+        matrix = CondensedDistanceMatrix.from_rows(n, rows, block_size, deadline)
+        if matrix is not None:
+            self.last_unreachable = unreachable
+        return matrix
@@ -0,0 +1,163 @@
+"""
+Condensed distance matrix
+Symmetric distances stored once, upper triangle only, as float32: N*(N-1)/2
+values instead of N*N float64, a quarter of the memory. Same layout as
+scipy.spatial.distance.squareform. Indexing mirrors a dense ndarray for the
+access patterns the solvers use, so they take either form.
+"""
+
+import time
+import numpy as np
+from typing import Optional
+from scipy.spatial.distance import cdist
+
+from domain.services.spatial_index import to_unit_vectors, chord_to_km
+
+
+class CondensedDistanceMatrix:
+    def __init__(self, values: np.ndarray, n: Optional[int] = None):
+        self.values = values
+        if n is None:
+            n = int(round((1 + np.sqrt(1 + 8 * len(values))) / 2))
+        self.n = n
+        if len(values) != n * (n - 1) // 2:
+            raise ValueError(f"{len(values)} condensed values do not match {n} points")
+
+    @classmethod
+    def from_rows(cls, n: int, rows, block_size: int = 1 << 22,
+                  deadline: Optional[float] = None) -> Optional['CondensedDistanceMatrix']:
+        # Fills the upper triangle from rows(start, stop), the distances from
+        # points start..stop-1 to points start..n-1, in blocks of about
+        # block_size values, never the full N x N. None when the deadline
+        # passes between blocks.
+        values = np.empty(n * (n - 1) // 2, dtype=np.float32)
+        step = max(1, block_size // max(n, 1))
+        for start in range(0, n - 1, step):
+            if deadline is not None and time.time() >= deadline:
+                return None
+            stop = min(start + step, n - 1)
+            block = rows(start, stop)
+            for r, i in enumerate(range(start, stop)):
+                offset = cls._row_offset(n, i)
+                values[offset:offset + n - i - 1] = block[r, r + 1:]
+        return cls(values, n)
+
+    @classmethod
+    def from_points(cls, points: np.ndarray, to_km=None, block_size: int = 1 << 22,
+                    deadline: Optional[float] = None) -> Optional['CondensedDistanceMatrix']:
+        # Euclidean distances between the points; to_km converts them when
+        # the points are not already in km
+        points = np.asarray(points, dtype=np.float64)
+
+        def rows(start, stop):
+            block = cdist(points[start:stop], points[start:])
+            return to_km(block) if to_km is not None else block
+
+        return cls.from_rows(len(points), rows, block_size, deadline)
+
+    @classmethod
+    def from_coordinates(cls, coordinates: np.ndarray,
+                         deadline: Optional[float] = None) -> Optional['CondensedDistanceMatrix']:
+        # Haversine: great-circle distance from the chord between unit vectors
+        return cls.from_points(to_unit_vectors(coordinates), to_km=chord_to_km, deadline=deadline)
+
+    @classmethod
+    def from_dense(cls, matrix: np.ndarray) -> 'CondensedDistanceMatrix':
+        n = len(matrix)
+        rows, cols = np.triu_indices(n, k=1)
+        return cls(np.asarray(matrix)[rows, cols].astype(np.float32), n)
+
+    @staticmethod
+    def _row_offset(n: int, i):
+        # Position of (i, i + 1) in the condensed array
+        return n * i - i * (i + 1) // 2
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    def __len__(self) -> int:
+        return self.n
+
+    def setflags(self, write: bool):
+        self.values.setflags(write=write)
+
+    def d(self, i: int, j: int) -> float:
+        if i == j:
+            return 0.0
+        if i > j:
+            i, j = j, i
+        return float(self.values[self.n * i - i * (i + 1) // 2 + j - i - 1])
+
+    # Reads widen to float64: only storage is single precision, so move
+    # deltas summed from these values do not pick up float32 rounding
+
+    def gather(self, i, j) -> np.ndarray:
+        # Vectorized d(i, j) over broadcast index arrays
+        i, j = np.broadcast_arrays(np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64))
+        lo = np.minimum(i, j)
+        hi = np.maximum(i, j)
+        idx = self.n * lo - lo * (lo + 1) // 2 + hi - lo - 1
+        same = lo == hi
+        if len(self.values) == 0:
+            return np.zeros(same.shape)
+        out = self.values[np.where(same, 0, idx)].astype(np.float64)
+        out[same] = 0.0
+        return out
+
+    def row(self, i: int) -> np.ndarray:
+        # Distances from i to every point: column i of the rows above it, then
+        # a contiguous slice for the points after it
+        out = np.empty(self.n)
+        if i > 0:
+            above = np.arange(i)
+            out[:i] = self.values[self._row_offset(self.n, above) + i - above - 1]
+        out[i] = 0.0
+        offset = self._row_offset(self.n, i)
+        out[i + 1:] = self.values[offset:offset + self.n - i - 1]
+        return out
+
+    def rows(self, idx) -> np.ndarray:
+        # len(idx) x N dense block
+        idx = np.asarray(idx, dtype=np.int64)
+        out = np.empty((len(idx), self.n))
+        for r, i in enumerate(idx):
+            out[r] = self.row(int(i))
+        return out
+
+    def to_dense(self, dtype=np.float64) -> np.ndarray:
+        dense = np.zeros((self.n, self.n), dtype=dtype)
+        rows, cols = np.triu_indices(self.n, k=1)
+        dense[rows, cols] = self.values
+        dense[cols, rows] = self.values
+        return dense
+
+    def tolist(self):
+        return self.to_dense().tolist()
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_dense(dtype or np.float64)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 2:
+            i, j = key
+            if isinstance(i, (int, np.integer)) and isinstance(j, (int, np.integer)):
+                return self.d(int(i), int(j))
+            if not isinstance(i, slice) and not isinstance(j, slice):
+                return self.gather(i, j)
+            if isinstance(i, (int, np.integer)):
+                return self.row(int(i))[j]
+            return self.rows(np.arange(self.n)[i])[:, j]
+        if isinstance(key, (int, np.integer)):
+            return self.row(int(key))
+        if isinstance(key, slice):
+            return self.rows(np.arange(self.n)[key])
+        return self.rows(key)
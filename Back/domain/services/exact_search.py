@@ -0,0 +1,101 @@
+"""
+Exact DFS engine shared by the sequential and parallel backtracking solvers
+"""
+
+import time
+from typing import List, Tuple, Optional, Callable
+
+
+def backtrack_search(dist: List[List[float]], prefix: List[int], bound: float,
+                     sync: Optional[Callable[[float], float]] = None,
+                     sync_every: int = 2048,
+                     deadline: Optional[float] = None) -> Tuple[Optional[List[int]], float, int, int, bool]:
+    # Iterative DFS over every tour that starts with `prefix`.
+    # - visited set is an int bitmask, the stack holds (node, distance, child pointer)
+    # - children are tried nearest first, from a per-node order sorted by distance
+    # - bound: distance so far + the cheapest outgoing edge of the current node
+    #   and of every unvisited node (each of them still has to be left once)
+    # Because the bound grows with the edge to the child, the first child that
+    # fails it cuts all of its remaining siblings at once.
+    # Only tours shorter than `bound` are reported. `sync` (optional) receives
+    # the local best and returns the global one, which tightens the bound; it
+    # is called every `sync_every` steps and after every improvement.
+    # The returned distance is always the length of the returned route (or
+    # `bound` when no route beat it), never the global bound.
+    # At `deadline` (a time.time() value) the search stops with what it has
+    # and reports timed_out.
+    n = len(dist)
+    order = [sorted((j for j in range(n) if j != i), key=row.__getitem__) for i, row in enumerate(dist)]
+    min_out = [min(row[j] for j in range(n) if j != i) if n > 1 else 0.0 for i, row in enumerate(dist)]
+
+    route = list(prefix)
+    mask = 0
+    for v in route:
+        mask |= 1 << v
+    start = route[0]
+    current_dist = sum(dist[route[i]][route[i + 1]] for i in range(len(route) - 1))
+    remaining = sum(min_out[v] for v in range(n) if not mask >> v & 1)
+
+    best_route = None
+    best_dist = float('inf')
+    nodes_explored = 1
+    prunes = 0
+    steps = 0
+    timed_out = False
+
+    if len(route) == n:
+        total = current_dist + dist[route[-1]][start]
+        if total < bound:
+            return route, total, nodes_explored, prunes, timed_out
+        return None, bound, nodes_explored, prunes, timed_out
+
+    # Frames: [node, distance so far, sum of min_out over unvisited, next child index]
+    stack = [[route[-1], current_dist, remaining, 0]]
+    while stack:
+        if steps % sync_every == 0:
+            if deadline is not None and time.time() >= deadline:
+                timed_out = True
+                break
+            if sync is not None:
+                bound = min(bound, sync(min(bound, best_dist)))
+        steps += 1
+
+        frame = stack[-1]
+        node, node_dist, node_remaining, ptr = frame
+        children = order[node]
+        if ptr == len(children):
+            stack.pop()
+            if stack:
+                mask ^= 1 << node
+                route.pop()
+            continue
+        frame[3] = ptr + 1
+
+        child = children[ptr]
+        if mask >> child & 1:
+            continue
+
+        step = node_dist + dist[node][child]
+        if len(route) + 1 == n:
+            nodes_explored += 1
+            total = step + dist[child][start]
+            if total < bound:
+                best_dist = bound = total
+                best_route = route + [child]
+                if sync is not None:
+                    bound = min(bound, sync(best_dist))
+            continue
+
+        if step + node_remaining >= bound:
+            prunes += 1
+            frame[3] = len(children)
+            continue
+
+        nodes_explored += 1
+        mask |= 1 << child
+        route.append(child)
+        stack.append([child, step, node_remaining - min_out[child], 0])
+
+    if best_route is None:
+        return None, bound, nodes_explored, prunes, timed_out
+    return best_route, best_dist, nodes_explored, prunes, timed_out
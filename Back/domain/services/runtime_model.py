@@ -0,0 +1,186 @@
+"""
+Solver runtime model
+Predicts how long TSPService.solve takes for a cluster of n points with a
+given method, and how far from optimal its tour is expected to be. Exact
+solvers follow their known complexity, a + c * f(n) with f(n) = n^2 * 2^n
+or n!, and the rest a + c * n^p (branch and bound too: its 1-tree bound
+prunes so much that the exponential worst case is not the typical one); the constants are measured once per process
+by timing the solver on random instances. Lin-Kernighan and simulated
+annealing run for a time limit or a number of iterations rather than until
+they converge: they are timed with a small budget and that budget is
+replaced by the real one in the fixed term a.
+"""
+
+import numpy as np
+import math
+import threading
+import time
+from typing import Dict, Iterable, Tuple
+
+from domain.services.tsp_service import TSPService
+
+
+class SolverRuntimeModel:
+    # Worst-case growth of the exact solvers; everything else is fitted as c * n^p
+    COMPLEXITY = {
+        'held_karp': lambda n: n * n * 2.0 ** n,
+        'brute_force': lambda n: math.factorial(max(n - 1, 1)),
+        'backtracking': lambda n: math.factorial(max(n - 1, 1)),
+        'parallel_backtracking': lambda n: math.factorial(max(n - 1, 1)),
+    }
+    # Sizes the constants are measured at
+    CALIBRATION_SIZES = {
+        'held_karp': (12, 14),
+        'brute_force': (7, 8),
+        'backtracking': (8, 9),
+        'parallel_backtracking': (8, 9),
+        'branch_and_bound': (12, 15, 18),
+        'nearest_neighbor_kdtree': (1000, 4000, 16000),
+        'space_filling': (1000, 4000, 16000),
+    }
+    DEFAULT_CALIBRATION_SIZES = (100, 400, 1600)
+    # Exponents tried for a + c * n^p
+    EXPONENTS = np.linspace(1.0, 3.0, 41)
+    # Iterations per annealing chain while calibrating; the rate per
+    # iteration is measured between this count and ten times it
+    CALIBRATION_ANNEALING_ITERATIONS = 2000
+    # Typical tour length over the optimum on random uniform instances
+    # (Johnson & McGeoch); an improvement stage caps the constructor's ratio
+    QUALITY = {
+        'held_karp': 1.0, 'brute_force': 1.0, 'backtracking': 1.0,
+        'parallel_backtracking': 1.0, 'branch_and_bound': 1.0,
+        'lin_kernighan': 1.02, 'simulated_annealing': 1.04,
+        'greedy_edge': 1.16, 'kruskal': 1.35, 'space_filling': 1.25,
+        'nearest_neighbor': 1.25, 'nearest_neighbor_kdtree': 1.25, 'k_means': 1.25,
+    }
+    IMPROVEMENT_QUALITY = {'two_opt': 1.05, '2opt': 1.05, 'oropt': 1.08, 'or_opt': 1.08, 'oropt_best': 1.07}
+
+    # Fitted (c, p, a) by (method, metric), shared by every instance
+    _coefficients: Dict[Tuple[str, str], Tuple[float, float, float]] = {}
+    # One calibration at a time, so a request arriving while the background
+    # warm-up measures its method waits for it instead of timing it again
+    _lock = threading.Lock()
+
+    def __init__(self, tsp_service: TSPService, method: str = 'auto', seed: int = 0):
+        self.tsp_service = tsp_service
+        self.method = method
+        self.seed = seed
+
+    @classmethod
+    def calibrate_in_background(cls, tsp_service: TSPService, methods: Iterable[str]) -> threading.Thread:
+        # Measures the methods in a daemon thread (at startup), so requests
+        # find the constants ready instead of paying for them
+        def run():
+            for method in methods:
+                model = cls(tsp_service, method)
+                for n in (2, tsp_service.HELD_KARP_MAX_POINTS + 1, tsp_service.EXACT_MAX_POINTS + 1, 5001):
+                    model.predict_time(n)
+
+        thread = threading.Thread(target=run, name='runtime-model-calibration', daemon=True)
+        thread.start()
+        return thread
+
+    def _calibrate(self, method: str) -> Tuple[float, float, float]:
+        key = (method, self.tsp_service.metric)
+        coefficient = SolverRuntimeModel._coefficients.get(key)
+        if coefficient is not None:
+            return coefficient
+        with SolverRuntimeModel._lock:
+            if key not in SolverRuntimeModel._coefficients:
+                SolverRuntimeModel._coefficients[key] = self._measure(method)
+            return SolverRuntimeModel._coefficients[key]
+
+    def _measure(self, method: str) -> Tuple[float, float, float]:
+        base_method = method.split('+')[0]
+        sizes = self.CALIBRATION_SIZES.get(base_method, self.DEFAULT_CALIBRATION_SIZES)
+        # No cache and no road network: every call really solves. The time
+        # limited solvers get a token budget, added back below.
+        source = self.tsp_service
+        service = TSPService(metric=source.metric,
+                             local_search_iterations=source.local_search_iterations,
+                             local_search_time_limit=source.local_search_time_limit,
+                             lin_kernighan_time_limit=0.0 if base_method == 'lin_kernighan'
+                             else source.lin_kernighan_time_limit,
+                             n_workers=source.n_workers,
+                             annealing_chains=source.annealing_chains,
+                             annealing_iterations=self.CALIBRATION_ANNEALING_ITERATIONS
+                             if base_method == 'simulated_annealing' else source.annealing_iterations,
+                             annealing_time_limit=source.annealing_time_limit)
+        rng = np.random.default_rng(self.seed)
+
+        def timed(n: int) -> float:
+            # A 50 km square, the scale of a typical cluster
+            coords = np.column_stack((rng.uniform(-12.2, -11.75, n), rng.uniform(-77.2, -76.75, n)))
+            start = time.perf_counter()
+            service.solve(coords, method)
+            return max(time.perf_counter() - start, 1e-6)
+
+        # Warm-up, the first call pays for lazy imports and allocations
+        timed(sizes[0])
+        times = np.array([timed(n) for n in sizes])
+        sizes = np.array(sizes, dtype=np.float64)
+
+        if base_method in self.COMPLEXITY:
+            # Fixed overhead a plus c * f(n) through the two largest sizes
+            f = self.COMPLEXITY[base_method]
+            c = max((times[-1] - times[-2]) / (f(sizes[-1]) - f(sizes[-2])), 0.0)
+            if c == 0.0:
+                c = times[-1] / f(sizes[-1])
+            return c, 0.0, max(times[-2] - c * f(sizes[-2]), 0.0)
+
+        c, p, a = self._fit_power_law(sizes, times)
+        if base_method == 'lin_kernighan':
+            # Kicks continue until the time limit, whatever the size
+            a += source.lin_kernighan_time_limit
+        elif base_method == 'simulated_annealing':
+            # The chains run a fixed number of iterations at a rate that
+            # barely depends on n (neighbour lists), capped by the time limit
+            service.annealing_iterations = 10 * self.CALIBRATION_ANNEALING_ITERATIONS
+            n = int(sizes[-1])
+            rate = max(timed(n) - times[-1], 0.0) / (9 * self.CALIBRATION_ANNEALING_ITERATIONS)
+            annealing = rate * (source.annealing_iterations - self.CALIBRATION_ANNEALING_ITERATIONS)
+            if source.annealing_time_limit is not None:
+                annealing = min(annealing, source.annealing_time_limit)
+            a += max(float(annealing), 0.0)
+        return c, p, a
+
+    @classmethod
+    def _fit_power_law(cls, sizes: np.ndarray, times: np.ndarray) -> Tuple[float, float, float]:
+        # t = a + c * n^p with a, c >= 0: linear least squares in (a, c) for
+        # every p of the grid, on relative errors so the small sizes count
+        # as much as the large ones; the p with the smallest error wins
+        best = None
+        weights = 1.0 / times
+        for p in cls.EXPONENTS:
+            design = np.column_stack((np.ones_like(sizes), sizes ** p)) * weights[:, None]
+            (a, c), *_ = np.linalg.lstsq(design, np.ones_like(times), rcond=None)
+            if a < 0:
+                a, c = 0.0, float(np.dot(design[:, 1], np.ones_like(times)) / np.dot(design[:, 1], design[:, 1]))
+            if c < 0:
+                a, c = float(np.sum(weights) / np.sum(weights ** 2)), 0.0
+            error = float(np.sum(((a + c * sizes ** p) * weights - 1.0) ** 2))
+            if best is None or error < best[0]:
+                best = (error, float(c), float(p), float(a))
+        return best[1:]
+
+    def predict_time(self, n: int) -> float:
+        # Seconds to solve one cluster of n points
+        if n <= 1:
+            return 0.0
+        method, _ = self.tsp_service.select_method(n, self.method)
+        c, p, a = self._calibrate(method)
+        base_method = method.split('+')[0]
+        if base_method in self.COMPLEXITY:
+            return a + c * self.COMPLEXITY[base_method](n)
+        return a + c * n ** p
+
+    def quality(self, n: int) -> float:
+        # Expected tour length / optimal tour length for n points
+        if n <= 3:
+            return 1.0
+        method, _ = self.tsp_service.select_method(n, self.method)
+        base_method, *improvements = method.split('+')
+        ratio = self.QUALITY.get(base_method, 1.25)
+        for improvement in improvements:
+            ratio = min(ratio, self.IMPROVEMENT_QUALITY.get(improvement, ratio))
+        return ratio
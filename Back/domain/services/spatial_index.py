@@ -0,0 +1,213 @@
+"""
+Spatial helpers for matrix-free solvers
+Points are mapped to 3D unit vectors: the chord distance between two of them
+is monotone in the haversine distance, so Euclidean KD-trees and MSTs over
+the vectors give the same neighbours and trees as haversine would.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree, connected_components
+from typing import Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def to_unit_vectors(coordinates: np.ndarray) -> np.ndarray:
+    coords_rad = np.radians(np.asarray(coordinates, dtype=np.float64))
+    lat = coords_rad[:, 0]
+    lon = coords_rad[:, 1]
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(km: np.ndarray) -> np.ndarray:
+    return 2 * np.sin(np.asarray(km) / (2 * EARTH_RADIUS_KM))
+
+
+def equirectangular_points(coordinates: np.ndarray, ref_lat: Optional[float] = None) -> np.ndarray:
+    # Plate carree around the mean latitude, in km: x = R * lon * cos(lat0),
+    # y = R * lat. Plain Euclidean distances between these points approximate
+    # haversine well over a cluster a few tens of km wide.
+    coords_rad = np.radians(np.asarray(coordinates, dtype=np.float64))
+    if ref_lat is None:
+        ref_lat = float(coords_rad[:, 0].mean()) if len(coords_rad) else 0.0
+    else:
+        ref_lat = np.radians(ref_lat)
+    return EARTH_RADIUS_KM * np.column_stack((coords_rad[:, 1] * np.cos(ref_lat), coords_rad[:, 0]))
+
+
+def degree_points(coordinates: np.ndarray) -> np.ndarray:
+    # Raw (lat, lon) degrees scaled to km along a meridian; no cos(lat)
+    # correction, so east-west distances come out too long away from the equator
+    return np.asarray(coordinates, dtype=np.float64) * (np.pi / 180.0 * EARTH_RADIUS_KM)
+
+
+def knn_edges(points: np.ndarray, k: int, tree: cKDTree = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Directed edges from every point to its k nearest other points
+    n = len(points)
+    k = min(k, n - 1)
+    if k <= 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+    tree = tree if tree is not None else cKDTree(points)
+    # Ask for one extra: duplicates can push a point out of its own first slot
+    dists, cols = tree.query(points, k=list(range(1, k + 2)))
+    rows = np.repeat(np.arange(n), k + 1)
+    cols = cols.ravel()
+    dists = dists.ravel()
+    keep = rows != cols
+    return rows[keep], cols[keep], dists[keep]
+
+
+def _spanning_forest(n: int, rows: np.ndarray, cols: np.ndarray, dists: np.ndarray) -> csr_matrix:
+    # Kruskal with union-find (scipy). Zero weights mean "no edge" in sparse
+    # matrices, so duplicates get a tiny positive weight instead.
+    graph = coo_matrix((dists + 1e-12, (rows, cols)), shape=(n, n)).tocsr()
+    return minimum_spanning_tree(graph)
+
+
+def euclidean_mst(points: np.ndarray, k: int = 10,
+                  edges: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> csr_matrix:
+    # MST over a k-nearest-neighbour candidate graph (built here unless the
+    # edges are given, Euclidean lengths between the points). The candidate
+    # graph can be disconnected (far apart groups), so components are joined
+    # Boruvka-style with their shortest outgoing edge until one tree is left.
+    n = len(points)
+    tree = None
+    if edges is None:
+        tree = cKDTree(points)
+        edges = knn_edges(points, k, tree)
+    rows, cols, dists = edges
+    forest = _spanning_forest(n, rows, cols, dists)
+    n_comp, labels = connected_components(forest, directed=False)
+
+    # Many small components are cheaper to absorb with a denser candidate graph
+    while n_comp > 32 and k < n - 1:
+        if tree is None:
+            tree = cKDTree(points)
+        k *= 2
+        rows, cols, dists = knn_edges(points, k, tree)
+        forest = _spanning_forest(n, rows, cols, dists)
+        n_comp, labels = connected_components(forest, directed=False)
+
+    while n_comp > 1:
+        extra_rows, extra_cols, extra_dists = [], [], []
+        for comp in range(n_comp):
+            inside = np.flatnonzero(labels == comp)
+            outside = np.flatnonzero(labels != comp)
+            d, j = cKDTree(points[outside]).query(points[inside])
+            best = int(np.argmin(d))
+            extra_rows.append(inside[best])
+            extra_cols.append(outside[j[best]])
+            extra_dists.append(d[best])
+        forest = forest.tocoo()
+        rows = np.concatenate((forest.row, extra_rows))
+        cols = np.concatenate((forest.col, extra_cols))
+        dists = np.concatenate((forest.data - 1e-12, extra_dists))
+        forest = _spanning_forest(n, rows, cols, dists)
+        n_comp, labels = connected_components(forest, directed=False)
+
+    return forest
+
+
+def preorder(tree: csr_matrix, root: int = 0) -> np.ndarray:
+    # Iterative DFS preorder of a (directed or not) tree, no recursion limit
+    n = tree.shape[0]
+    sym = (tree + tree.T).tocsr()
+    indptr, indices = sym.indptr, sym.indices
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    count = 0
+    stack = [root]
+    while stack:
+        u = stack.pop()
+        if visited[u]:
+            continue
+        visited[u] = True
+        order[count] = u
+        count += 1
+        children = indices[indptr[u]:indptr[u + 1]]
+        stack.extend(children[~visited[children]][::-1].tolist())
+    return order[:count]
+
+
+def nearest_neighbor_order(points: np.ndarray, start: int = 0) -> np.ndarray:
+    # Nearest neighbour walk in O(n log n) time and O(n) memory. cKDTree has no
+    # delete, so visited points are deleted lazily: queries skip them, and the
+    # tree is rebuilt over the unvisited points once half of it is stale.
+    n = len(points)
+    order = np.empty(n, dtype=np.int64)
+    order[0] = start
+    if n == 1:
+        return order
+
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    alive = np.flatnonzero(~visited)
+    tree = cKDTree(points[alive])
+    stale = 0
+    current = start
+
+    for step in range(1, n):
+        if stale * 2 > len(alive):
+            alive = np.flatnonzero(~visited)
+            tree = cKDTree(points[alive])
+            stale = 0
+
+        k = 8
+        while True:
+            k = min(k, len(alive))
+            _, j = tree.query(points[current], k=list(range(1, k + 1)))
+            candidates = alive[j]
+            fresh = candidates[~visited[candidates]]
+            if len(fresh) or k == len(alive):
+                break
+            k *= 2
+
+        current = int(fresh[0])
+        order[step] = current
+        visited[current] = True
+        stale += 1
+
+    return order
+
+
+def hilbert_order(coordinates: np.ndarray, bits: int = 16) -> np.ndarray:
+    # Sort order of the points along a Hilbert curve over their bounding box.
+    # Fully vectorized, no distances at all: O(n log n) for the final argsort.
+    coords = np.asarray(coordinates, dtype=np.float64)
+    n = len(coords)
+    if n <= 1:
+        return np.arange(n)
+
+    lat = coords[:, 0]
+    lon = coords[:, 1]
+    # Same scale on both axes (longitude shrinks with latitude)
+    x = (lon - lon.min()) * np.cos(np.radians(lat.mean()))
+    y = lat - lat.min()
+    span = max(x.max(), y.max()) or 1.0
+    side = 1 << bits
+    x = np.minimum((x / span * (side - 1)).astype(np.int64), side - 1)
+    y = np.minimum((y / span * (side - 1)).astype(np.int64), side - 1)
+
+    d = np.zeros(n, dtype=np.int64)
+    s = side >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # Rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x[flip] = side - 1 - x[flip]
+        y[flip] = side - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s >>= 1
+
+    return np.argsort(d, kind='stable')
@@ -0,0 +1,60 @@
+"""
+Content-addressed LRU cache for TSPService
+Entries are keyed by a hash of the coordinate bytes (plus what was computed
+from them), so identical point sets hit the cache whatever request they came
+from. The total size of the cached arrays is capped.
+"""
+
+import numpy as np
+from collections import OrderedDict
+import hashlib
+from typing import Any, Dict, Optional
+
+
+class TSPCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def make_key(coordinates: np.ndarray, *parts: Any) -> str:
+        coords = np.ascontiguousarray(coordinates, dtype=np.float64)
+        digest = hashlib.blake2b(coords.tobytes(), digest_size=16)
+        digest.update(repr((coords.shape,) + parts).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, value: Any, nbytes: int):
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, nbytes)
+        self._bytes += nbytes
+        # Evict least recently used entries until under the cap
+        while self._bytes > self.max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
@@ -0,0 +1,204 @@
+"""
+Parallel TSP workers
+Module-level functions so a ProcessPoolExecutor can pickle them. The distance
+matrix is shared through multiprocessing.shared_memory instead of being
+pickled into every worker.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+import math
+import random
+import time
+from typing import List, Tuple, Dict, Any, Optional
+
+from domain.services.exact_search import backtrack_search
+from domain.services.distance_matrix import CondensedDistanceMatrix
+
+
+class SharedMatrix:
+    # Owner side of a shared distance matrix; use as a context manager
+    def __init__(self, matrix: np.ndarray):
+        self.shape = matrix.shape
+        self.dtype = matrix.dtype.str
+        self._shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        view = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        view[:] = matrix
+        del view
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def __enter__(self) -> 'SharedMatrix':
+        return self
+
+    def __exit__(self, *exc):
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _attach(name: str, shape: Tuple[int, ...], dtype: str) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def annealing_chain(shm_name: str, shape: Tuple[int, ...], dtype: str, route: List[int],
+                    neighbors: np.ndarray, seed: int, iterations: int,
+                    time_limit: Optional[float] = None) -> Tuple[List[int], float, Dict[str, Any]]:
+    # One simulated annealing chain over 2-opt and Or-opt moves, each with an
+    # O(1) delta from the shared matrix. Moves always create an edge to one of
+    # the k nearest neighbours, so most proposals are plausible. Geometric
+    # cooling from a temperature sampled off the starting tour.
+    shm, dist = _attach(shm_name, shape, dtype)
+    if dist.ndim == 1:
+        dist = CondensedDistanceMatrix(dist)
+    try:
+        start_time = time.time()
+        rng = random.Random(seed)
+        tour = list(route)
+        n = len(tour)
+        k_near = neighbors.shape[1]
+        neighbors = neighbors.tolist()
+        pos = [0] * n
+        for idx, v in enumerate(tour):
+            pos[v] = idx
+        length = float(sum(dist[tour[i - 1], tour[i]] for i in range(n)))
+        best_tour, best_length = tour[:], length
+        accepted = 0
+        improvements = 0
+
+        def two_opt_move():
+            a = rng.randrange(n)
+            c = neighbors[a][rng.randrange(k_near)]
+            i, j = pos[a], pos[c]
+            if i > j:
+                i, j = j, i
+            if j - i < 2 or (i == 0 and j == n - 1):
+                return None
+            a, b, c, d = tour[i], tour[i + 1], tour[j], tour[(j + 1) % n]
+            return dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d], ('2opt', i, j)
+
+        def or_opt_move():
+            k = rng.randint(1, 3)
+            i = rng.randrange(1, n - k)
+            target = neighbors[tour[i]][rng.randrange(k_near)]
+            j = pos[target]
+            if i - 1 <= j <= i + k - 1:
+                return None
+            p, s1, sk, nx = tour[i - 1], tour[i], tour[i + k - 1], tour[(i + k) % n]
+            u, v = tour[j], tour[(j + 1) % n]
+            if v == s1:
+                return None
+            delta = (dist[p, nx] + dist[u, sk] + dist[s1, v]
+                     - dist[p, s1] - dist[sk, nx] - dist[u, v])
+            return delta, ('oropt', i, j, k)
+
+        sample = []
+        for _ in range(200):
+            move = two_opt_move() if rng.random() < 0.5 else or_opt_move()
+            if move is not None and move[0] > 0:
+                sample.append(move[0])
+        temperature = max(float(np.mean(sample)) if sample else 1.0, 1e-9)
+        cooling = 0.0005 ** (1.0 / max(iterations, 1))
+
+        it = 0
+        for it in range(iterations):
+            if time_limit is not None and it % 1000 == 0 and time.time() - start_time > time_limit:
+                break
+            temperature *= cooling
+
+            move = two_opt_move() if rng.random() < 0.5 else or_opt_move()
+            if move is None:
+                continue
+            delta, op = move
+            if delta > 0 and rng.random() >= math.exp(-delta / temperature):
+                continue
+
+            if op[0] == '2opt':
+                _, i, j = op
+                tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+                lo, hi = i + 1, j + 1
+            else:
+                # Segment goes in reversed: u -> sk ... s1 -> v
+                _, i, j, k = op
+                segment = tour[i:i + k][::-1]
+                del tour[i:i + k]
+                cut = j + 1 if j < i else j + 1 - k
+                tour[cut:cut] = segment
+                lo, hi = min(i, cut), max(i + k, cut + k)
+            for idx in range(lo, hi):
+                pos[tour[idx]] = idx
+
+            accepted += 1
+            length += delta
+            if length < best_length - 1e-10:
+                best_length = length
+                best_tour = tour[:]
+                improvements += 1
+
+        best_length = float(sum(dist[best_tour[i - 1], best_tour[i]] for i in range(n)))
+        chain_stats = {
+            'seed': seed,
+            'distance': best_length,
+            'iterations': it + 1,
+            'accepted': accepted,
+            'improvements': improvements,
+            'time': time.time() - start_time,
+        }
+        return best_tour, best_length, chain_stats
+    finally:
+        # Rebound, not deleted: the move closures above still refer to it
+        dist = None
+        shm.close()
+
+
+# Best tour length known to any worker, installed by init_shared_bound
+_shared_bound = None
+
+
+def init_shared_bound(bound) -> None:
+    # ProcessPoolExecutor initializer: a multiprocessing.Value can only reach the
+    # workers through inheritance, not through submit()
+    global _shared_bound
+    _shared_bound = bound
+
+
+def _sync_shared_bound(local_best: float) -> float:
+    # Publish a local improvement and read back the global best
+    with _shared_bound.get_lock():
+        if local_best < _shared_bound.value:
+            _shared_bound.value = local_best
+        return _shared_bound.value
+
+
+def backtrack_branch(shm_name: str, shape: Tuple[int, ...], dtype: str, prefix: List[int],
+                     deadline: Optional[float] = None) -> Tuple[Optional[List[int]], float, int, int, bool]:
+    # Exhaustive search below a fixed route prefix. A good tour found by one
+    # worker tightens the pruning in all of them through the shared bound.
+    shm, dist = _attach(shm_name, shape, dtype)
+    try:
+        matrix = dist.tolist()
+    finally:
+        del dist
+        shm.close()
+    return backtrack_search(matrix, prefix, _shared_bound.value, sync=_sync_shared_bound, deadline=deadline)
+
+
+def dijkstra_rows(csr_specs: List[Tuple[str, Tuple[int, ...], str]], n_nodes: int,
+                  sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    # Shortest path lengths from a batch of road nodes, restricted to the
+    # target columns so only a small block travels back to the parent.
+    # csr_specs are the shared (indptr, indices, weights) arrays of the graph.
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+
+    handles, arrays = zip(*(_attach(*spec) for spec in csr_specs))
+    try:
+        graph = csr_matrix(arrays[::-1], shape=(n_nodes, n_nodes), copy=False)
+        rows = dijkstra(graph, directed=False, indices=sources)[:, targets]
+    finally:
+        graph = arrays = None
+        for shm in handles:
+            shm.close()
+    return rows
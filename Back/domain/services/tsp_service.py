@@ -4,11 +4,126 @@ Refactored for DDD
 """
 
 import numpy as np
-from itertools import permutations
+from itertools import permutations, islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import heapq
 import time
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
+from scipy.spatial.distance import cdist
+
+from domain.services.exact_search import backtrack_search
+from domain.services.tsp_cache import TSPCache
+from domain.services.distance_backend import RoadNetworkBackend
+from domain.services.distance_matrix import CondensedDistanceMatrix
+from domain.services.candidate_graph import CandidateGraph
+from domain.services.geodesic import geodesic_matrix, geodesic_rows, route_length as geodesic_route_length
+from domain.services.tsp_parallel import SharedMatrix, annealing_chain, init_shared_bound, backtrack_branch
+from domain.services.spatial_index import (
+    to_unit_vectors, chord_to_km, km_to_chord, equirectangular_points, degree_points,
+    knn_edges, euclidean_mst, preorder, nearest_neighbor_order, hilbert_order
+)
+
+class _ArrayTour:
+    # Tour stored as an array plus the position of every node, so next/prev/between
+    # are O(1) and a flip is a single vectorized slice reversal.
+    def __init__(self, route: List[int]):
+        self.n = len(route)
+        self.tour = np.array(route, dtype=np.int64)
+        self.pos = np.empty(self.n, dtype=np.int64)
+        self.pos[self.tour] = np.arange(self.n)
+
+    def next(self, v: int) -> int:
+        return int(self.tour[(self.pos[v] + 1) % self.n])
+
+    def prev(self, v: int) -> int:
+        return int(self.tour[self.pos[v] - 1])
+
+    def between(self, a: int, b: int, c: int) -> bool:
+        # True if b lies on the forward path from a to c
+        pa = self.pos[a]
+        return (self.pos[b] - pa) % self.n <= (self.pos[c] - pa) % self.n
+
+    def reverse_range(self, start: int, length: int):
+        if length < 2:
+            return
+        idx = (start + np.arange(length)) % self.n
+        self.tour[idx] = self.tour[idx[::-1]]
+        self.pos[self.tour[idx]] = idx
+
+    def flip(self, a: int, b: int) -> Tuple[int, int]:
+        # Reverse the forward path a..b. Reversing the rest of the tour gives the
+        # same cycle, so the shorter side is reversed (the orientation may change).
+        # Returns the reversed range so the flip can be undone.
+        start = int(self.pos[a])
+        length = int((self.pos[b] - start) % self.n) + 1
+        if 2 * length > self.n:
+            start = int((self.pos[b] + 1) % self.n)
+            length = self.n - length
+        self.reverse_range(start, length)
+        return start, length
+
+    def swap_adjacent(self, start: int, first_len: int, total_len: int):
+        # [A][B] -> [B][A] for the two consecutive segments starting at `start`
+        self.reverse_range(start, first_len)
+        self.reverse_range((start + first_len) % self.n, total_len - first_len)
+        self.reverse_range(start, total_len)
+
 
 class TSPService:
+    METRICS = ('haversine', 'geodesic', 'equirectangular', 'euclidean')
+    # Fast approximations, only used inside the solvers
+    APPROXIMATE_METRICS = ('equirectangular', 'euclidean')
+    # Largest cluster 'auto' still solves exactly: Held-Karp while its
+    # n^2 * 2^n table takes milliseconds, branch and bound above that
+    HELD_KARP_MAX_POINTS = 12
+    EXACT_MAX_POINTS = 18
+
+    def __init__(self, local_search_iterations: int = 10000,
+                 local_search_time_limit: Optional[float] = None,
+                 n_neighbors: int = 10,
+                 lin_kernighan_time_limit: float = 1.0,
+                 n_workers: Optional[int] = None,
+                 annealing_chains: Optional[int] = None,
+                 annealing_iterations: int = 200000,
+                 annealing_time_limit: Optional[float] = None,
+                 cache: Optional[TSPCache] = None,
+                 distance_backend: Optional[RoadNetworkBackend] = None,
+                 condensed_min_points: Optional[int] = 10000,
+                 metric: str = 'haversine'):
+        # Caps for the improvement stages ('+two_opt', '+oropt' method suffixes).
+        # local_search_iterations counts applied moves, the time limit is in seconds.
+        self.local_search_iterations = local_search_iterations
+        self.local_search_time_limit = local_search_time_limit
+        self.n_neighbors = n_neighbors
+        # Total budget of 'lin_kernighan', including the random restarts (kicks)
+        self.lin_kernighan_time_limit = lin_kernighan_time_limit
+        # Process pool size of the parallel solvers; 'simulated_annealing' runs
+        # one independent chain per worker process by default
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.annealing_chains = annealing_chains or self.n_workers
+        self.annealing_iterations = annealing_iterations
+        self.annealing_time_limit = annealing_time_limit
+        # Optional shared cache of distance matrices and solved tours
+        self.cache = cache
+        # Source of the distance matrices; None means straight-line haversine
+        self.distance_backend = distance_backend
+        # From this many points on, matrices are stored as a condensed float32
+        # upper triangle (a quarter of the memory); None keeps them dense.
+        # Reads from it are several times slower (two_opt and the road
+        # network paths ~4x at 3000 points), so it only pays off where the
+        # dense matrix is large: 800 MB against 200 MB at 10000 points
+        self.condensed_min_points = condensed_min_points
+        # Straight-line metric of the matrices: 'haversine', 'geodesic' (WGS-84
+        # ellipsoid), 'equirectangular' (flat projection around the cluster's
+        # mean latitude) or 'euclidean' (raw degrees). The approximations are
+        # only used inside the solvers, their tours are measured in haversine.
+        if metric not in self.METRICS:
+            raise ValueError(f"Unknown metric '{metric}'")
+        self.metric = metric
+
     @staticmethod
     def calculate_distance(coord1: np.ndarray, coord2: np.ndarray) -> float:
         # Haversine formula for single pair (fallback or single use)
@@ -21,143 +136,772 @@ class TSPService:
         c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
         return R * c
 
-    def _precompute_distance_matrix(self, coordinates: np.ndarray) -> np.ndarray:
-        # Vectorized Haversine for N x N matrix
+    def _precompute_distance_matrix(self, coordinates: np.ndarray, deadline: Optional[float] = None,
+                                    rows_per_block: int = 256) -> Optional[np.ndarray]:
+        # Vectorized Haversine for N x N matrix, a block of rows at a time so
+        # a deadline can stop it (None when it does)
         R = 6371.0
         # Convert to radians
         coords_rad = np.radians(coordinates)
         lat = coords_rad[:, 0]
         lon = coords_rad[:, 1]
-        
-        # Broadcasting to get differences matrix (N x N)
-        dlat = lat[:, np.newaxis] - lat
-        dlon = lon[:, np.newaxis] - lon
-        
-        # Haversine formula vectorized
-        a = np.sin(dlat / 2)**2 + np.cos(lat[:, np.newaxis]) * np.cos(lat) * np.sin(dlon / 2)**2
-        # Clip to [0, 1] to avoid numerical errors with sqrt
-        a = np.clip(a, 0, 1)
-        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-        
-        return R * c
+        cos_lat = np.cos(lat)
+
+        matrix = np.empty((len(coordinates), len(coordinates)))
+        for start in range(0, len(coordinates), rows_per_block):
+            if self._expired(deadline):
+                return None
+            rows = slice(start, start + rows_per_block)
+            # Broadcasting to get differences block (rows x N)
+            dlat = lat[rows, np.newaxis] - lat
+            dlon = lon[rows, np.newaxis] - lon
+
+            # Haversine formula vectorized
+            a = np.sin(dlat / 2)**2 + cos_lat[rows, np.newaxis] * cos_lat * np.sin(dlon / 2)**2
+            # Clip to [0, 1] to avoid numerical errors with sqrt
+            a = np.clip(a, 0, 1)
+            matrix[rows] = R * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+
+        return matrix
+
+    @property
+    def distance_source(self) -> str:
+        return self.distance_backend.name if self.distance_backend is not None else self.metric
+
+    def _metric_points(self, coordinates: np.ndarray) -> np.ndarray:
+        # Planar points (km) whose Euclidean distances are the approximate metric
+        if self.metric == 'equirectangular':
+            return equirectangular_points(coordinates)
+        return degree_points(coordinates)
+
+    def calculate_metric_route_distance(self, coordinates: np.ndarray, ruta: List[int]) -> float:
+        # Matrix-free route length: over roads with a distance backend,
+        # ellipsoidal for 'geodesic', haversine otherwise
+        if self.distance_backend is not None:
+            return self.distance_backend.route_length(coordinates, ruta)
+        if self.metric == 'geodesic':
+            return geodesic_route_length(coordinates, ruta)
+        return self.calculate_route_distance(coordinates, ruta)
+
+    def metric_error(self, coordinates: np.ndarray, sample_size: int = 4096) -> float:
+        # Largest relative error of the approximate metric against haversine,
+        # over a fixed sample of pairs plus every pair with the northernmost
+        # and southernmost points (where the cos(lat) scaling is worst)
+        n = len(coordinates)
+        if self.metric not in self.APPROXIMATE_METRICS or n < 2:
+            return 0.0
+        coords = np.asarray(coordinates, dtype=np.float64)
+        rng = np.random.default_rng(0)
+        i = rng.integers(0, n, sample_size)
+        j = rng.integers(0, n, sample_size)
+        extremes = np.array([np.argmin(coords[:, 0]), np.argmax(coords[:, 0])])
+        i = np.concatenate((i, np.repeat(extremes, n)))
+        j = np.concatenate((j, np.tile(np.arange(n), 2)))
+        points = self._metric_points(coords)
+        approx = np.sqrt(np.sum((points[i] - points[j])**2, axis=1))
+        units = to_unit_vectors(coords)
+        exact = chord_to_km(np.sqrt(np.sum((units[i] - units[j])**2, axis=1)))
+        valid = exact > 1e-9
+        if not valid.any():
+            return 0.0
+        return float(np.max(np.abs(approx[valid] - exact[valid]) / exact[valid]))
+
+    def _use_condensed(self, n: int) -> bool:
+        return self.condensed_min_points is not None and n >= self.condensed_min_points
+
+    def _compute_distance_matrix(self, coordinates: np.ndarray,
+                                 deadline: Optional[float] = None) -> Optional[np.ndarray]:
+        # None when the deadline passes before the matrix is complete
+        condensed = self._use_condensed(len(coordinates))
+        if self.distance_backend is not None:
+            if condensed:
+                return self.distance_backend.condensed_matrix(coordinates, deadline)
+            return self.distance_backend.distance_matrix(coordinates)
+        if self.metric == 'geodesic':
+            if condensed:
+                return CondensedDistanceMatrix.from_rows(
+                    len(coordinates), lambda start, stop: geodesic_rows(coordinates, start, stop),
+                    deadline=deadline)
+            return geodesic_matrix(coordinates)
+        if self.metric in self.APPROXIMATE_METRICS:
+            points = self._metric_points(coordinates)
+            if condensed:
+                return CondensedDistanceMatrix.from_points(points, deadline=deadline)
+            return cdist(points, points)
+        if condensed:
+            return CondensedDistanceMatrix.from_coordinates(coordinates, deadline=deadline)
+        return self._precompute_distance_matrix(coordinates, deadline)
+
+    def get_distance_matrix(self, coordinates: np.ndarray,
+                            deadline: Optional[float] = None) -> Optional[np.ndarray]:
+        # Matrix from the distance backend behind the cache, when there is one.
+        # Cached matrices are shared, so they are made read-only. A matrix cut
+        # short by the deadline is None and is not cached.
+        if self.cache is None:
+            return self._compute_distance_matrix(coordinates, deadline)
+        key = TSPCache.make_key(coordinates, 'distance_matrix', self.distance_source,
+                                self._use_condensed(len(coordinates)))
+        matrix = self.cache.get(key)
+        if matrix is None:
+            matrix = self._compute_distance_matrix(coordinates, deadline)
+            if matrix is None:
+                return None
+            matrix.setflags(write=False)
+            self.cache.put(key, matrix, matrix.nbytes)
+        return matrix
+
+    def get_candidate_graph(self, coordinates: np.ndarray, dist_matrix: Optional[np.ndarray] = None) -> CandidateGraph:
+        # k nearest neighbours of every point, cached like the matrices. With a
+        # distance backend and its matrix at hand they come from the matrix, so
+        # they agree with the distances the solvers see; otherwise a KD-tree
+        # gives the haversine ones without any matrix.
+        # Ellipsoidal distances can order near-ties differently from the
+        # sphere, so they also take their neighbours from the matrix
+        from_matrix = ((self.distance_backend is not None or self.metric == 'geodesic')
+                       and dist_matrix is not None)
+        source = self.distance_source if from_matrix else self.metric
+        key = None
+        if self.cache is not None:
+            key = TSPCache.make_key(coordinates, 'candidates', self.n_neighbors, source)
+            candidates = self.cache.get(key)
+            if candidates is not None:
+                return candidates
+        if from_matrix:
+            candidates = CandidateGraph.from_distance_matrix(dist_matrix, self.n_neighbors)
+        elif self.metric in self.APPROXIMATE_METRICS:
+            # The approximate metrics are planar, a 2-D KD-tree is exact for them
+            candidates = CandidateGraph.from_points(self._metric_points(coordinates), self.n_neighbors)
+        else:
+            candidates = CandidateGraph.from_coordinates(coordinates, self.n_neighbors)
+        if key is not None:
+            candidates.setflags(write=False)
+            self.cache.put(key, candidates, candidates.nbytes)
+        return candidates
 
     @staticmethod
     def calculate_total_distance(dist_matrix: np.ndarray, ruta: List[int]) -> float:
-        distancia = 0
-        for i in range(len(ruta) - 1):
-            distancia += dist_matrix[ruta[i], ruta[i+1]]
-        distancia += dist_matrix[ruta[-1], ruta[0]]
-        return distancia
+        # Closed tour length as one gather of its edges (dense or condensed)
+        ruta = np.asarray(ruta, dtype=np.int64)
+        if len(ruta) == 0:
+            return 0.0
+        return float(np.sum(dist_matrix[ruta, np.roll(ruta, -1)]))
 
-    def solve(self, coordinates: np.ndarray, method: str = 'auto') -> Tuple[List[int], float, Dict[str, Any]]:
-        n = len(coordinates)
-        original_method = method
-        warning = None
+    @staticmethod
+    def calculate_total_distances(dist_matrix: np.ndarray, rutas: np.ndarray) -> np.ndarray:
+        # Lengths of many closed tours at once, one per row of a 2-D array
+        rutas = np.asarray(rutas, dtype=np.int64)
+        if rutas.shape[1] == 0:
+            return np.zeros(len(rutas))
+        return np.sum(dist_matrix[rutas, np.roll(rutas, -1, axis=1)], axis=1)
+
+    # O(1) length change of a move on a closed tour, from positions i and j.
+    # Negative means the move shortens the tour.
 
+    @staticmethod
+    def swap_delta(dist_matrix: np.ndarray, ruta: List[int], i: int, j: int) -> float:
+        # Exchange the nodes at positions i and j
+        n = len(ruta)
+        if i == j or n < 3:
+            return 0.0
+        if i > j:
+            i, j = j, i
+        if i == 0 and j == n - 1:
+            # Adjacent across the wrap: ... p, b | a, q ... with b = ruta[j], a = ruta[0]
+            i, j = j, i
+        a, b = ruta[i], ruta[j]
+        p, q = ruta[i - 1], ruta[(j + 1) % n]
+        if (i + 1) % n == j:
+            if n == 3:
+                return 0.0
+            # p, a, b, q -> p, b, a, q
+            return float(dist_matrix[p, b] + dist_matrix[a, q] - dist_matrix[p, a] - dist_matrix[b, q])
+        a_next, b_prev = ruta[(i + 1) % n], ruta[j - 1]
+        return float(dist_matrix[p, b] + dist_matrix[b, a_next] + dist_matrix[b_prev, a] + dist_matrix[a, q]
+                     - dist_matrix[p, a] - dist_matrix[a, a_next] - dist_matrix[b_prev, b] - dist_matrix[b, q])
+
+    @staticmethod
+    def two_opt_delta(dist_matrix: np.ndarray, ruta: List[int], i: int, j: int) -> float:
+        # Replace edges (ruta[i], ruta[i+1]) and (ruta[j], ruta[j+1]) by
+        # (ruta[i], ruta[j]) and (ruta[i+1], ruta[j+1]): reverse ruta[i+1..j]
+        n = len(ruta)
+        if i > j:
+            i, j = j, i
+        if j - i < 2 or (i == 0 and j == n - 1):
+            return 0.0
+        a, b = ruta[i], ruta[i + 1]
+        c, d = ruta[j], ruta[(j + 1) % n]
+        return float(dist_matrix[a, c] + dist_matrix[b, d] - dist_matrix[a, b] - dist_matrix[c, d])
+
+    @staticmethod
+    def relocate_delta(dist_matrix: np.ndarray, ruta: List[int], i: int, j: int) -> float:
+        # Move the node at position i between positions j and j+1
+        n = len(ruta)
+        if n < 3 or j == i or j == (i - 1) % n:
+            return 0.0
+        v = ruta[i]
+        p, q = ruta[i - 1], ruta[(i + 1) % n]
+        u, w = ruta[j], ruta[(j + 1) % n]
+        return float(dist_matrix[p, q] - dist_matrix[p, v] - dist_matrix[v, q]
+                     + dist_matrix[u, v] + dist_matrix[v, w] - dist_matrix[u, w])
+
+    @staticmethod
+    def calculate_route_distance(coordinates: np.ndarray, ruta: List[int]) -> float:
+        # Haversine length of a closed route straight from coordinates, O(n) memory
+        R = 6371.0
+        coords_rad = np.radians(np.asarray(coordinates, dtype=np.float64)[ruta])
+        nxt = np.roll(coords_rad, -1, axis=0)
+        dlat = nxt[:, 0] - coords_rad[:, 0]
+        dlon = nxt[:, 1] - coords_rad[:, 1]
+        a = np.sin(dlat / 2)**2 + np.cos(coords_rad[:, 0]) * np.cos(nxt[:, 0]) * np.sin(dlon / 2)**2
+        a = np.clip(a, 0, 1)
+        return float(np.sum(R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))))
+
+    @staticmethod
+    def _expired(deadline: Optional[float]) -> bool:
+        return deadline is not None and time.time() >= deadline
+
+    def select_method(self, n: int, method: str = 'auto') -> Tuple[str, Optional[str]]:
+        # Concrete method that solve() runs for n points, plus a warning
+        warning = None
+        exact = 'held_karp' if n <= self.HELD_KARP_MAX_POINTS else 'branch_and_bound'
         if method == 'auto':
-            if n <= 8:
-                method = 'brute_force'
-            elif n <= 12:
-                method = 'backtracking'
+            if n <= self.EXACT_MAX_POINTS:
+                method = exact
+            elif n <= 5000:
+                method = 'greedy_edge+two_opt'
             else:
-                method = 'nearest_neighbor'
+                # Past this size an N x N matrix no longer fits comfortably
+                method = 'nearest_neighbor_kdtree'
+
+        if method == 'dijkstra':
+            # Shortest road paths fill the matrix (see distance_backend), the
+            # tour over them comes from an exact or local search solver
+            if self.distance_backend is None:
+                warning = "WARNING: No road network loaded, 'dijkstra' uses straight-line distances."
+            method = exact if n <= self.EXACT_MAX_POINTS else 'nearest_neighbor+two_opt+oropt'
+        return method, warning
+
+    def solve(self, coordinates: np.ndarray, method: str = 'auto',
+              time_budget_ms: Optional[float] = None) -> Tuple[List[int], float, Dict[str, Any]]:
+        # With a time budget every solver stops at the deadline and returns its
+        # best tour so far (at worst the nearest neighbor one), flagging
+        # stats['timed_out']
+        n = len(coordinates)
+        original_method = method
+        method, warning = self.select_method(n, method)
+
+        # A method can chain improvement stages, e.g. 'kruskal+two_opt+oropt'
+        base_method, *improvements = method.split('+')
+        for improvement in improvements:
+            if improvement not in ('two_opt', '2opt', 'oropt', 'or_opt', 'oropt_best'):
+                raise ValueError(f"Unknown improvement stage '{improvement}'")
         
-        if method == 'brute_force' and n > 8:
+        if base_method == 'brute_force' and n > 8:
             warning = f"WARNING: Brute force with {n} points is slow."
-        elif method == 'backtracking' and n > 12:
+        elif base_method == 'backtracking' and n > 12:
             warning = f"WARNING: Backtracking with {n} points is slow."
+        elif base_method == 'parallel_backtracking' and n > 15:
+            warning = f"WARNING: Parallel backtracking with {n} points is slow."
+        elif base_method == 'branch_and_bound' and n > 40:
+            warning = f"WARNING: Branch and bound with {n} points may be slow."
+        elif base_method == 'held_karp' and n > 20:
+            warning = f"WARNING: Held-Karp with {n} points needs O(n*2^n) memory."
 
         start_time = time.time()
+        deadline = start_time + time_budget_ms / 1000.0 if time_budget_ms is not None else None
+
+        tour_key = None
+        if self.cache is not None:
+            tour_key = TSPCache.make_key(coordinates, 'tour', original_method, self.distance_source)
+            cached = self.cache.get(tour_key)
+            if cached is not None:
+                route, distance, cached_stats = cached
+                stats = dict(cached_stats, cache_hit=True, execution_time=time.time() - start_time)
+                return list(route), distance, stats
+
         stats = {'method': method, 'original_method': original_method}
 
-        # Precompute distance matrix (O(N^2) but vectorized and fast)
-        dist_matrix = self._precompute_distance_matrix(coordinates)
-
-        if method == 'brute_force':
-            route, distance = self._solve_brute_force(dist_matrix)
-        elif method == 'backtracking':
-            route, distance = self._solve_backtracking(dist_matrix, stats)
-        elif method == 'kruskal':
-            route, distance = self._solve_mst_tsp(dist_matrix)
-        elif method == 'dijkstra':
-            route, distance = self._solve_nearest_neighbor(dist_matrix)
-        elif method == 'k_means':
-             route, distance = self._solve_nearest_neighbor(dist_matrix)
+        # Precompute distance matrix (O(N^2) but vectorized and fast).
+        # Matrix-free constructors skip it unless an improvement stage needs it.
+        matrix_free = ('kruskal', 'nearest_neighbor_kdtree', 'greedy_edge', 'space_filling')
+        dist_matrix = None
+        if base_method not in matrix_free or improvements:
+            dist_matrix = self.get_distance_matrix(coordinates, deadline)
+            if base_method in ('brute_force', 'held_karp', 'backtracking', 'parallel_backtracking',
+                               'branch_and_bound') and isinstance(dist_matrix, CondensedDistanceMatrix):
+                # Exact solvers only run on small inputs and want the full table
+                dist_matrix = dist_matrix.to_dense()
+            if self._expired(deadline):
+                # The matrix used up the budget: a matrix-free greedy tour is
+                # the answer, and there is no time left to improve it
+                stats['timed_out'] = True
+                dist_matrix = None
+                improvements = []
+                if base_method not in matrix_free:
+                    stats['fallback_method'] = 'greedy_edge'
+                    base_method = 'greedy_edge'
+
+        # Shared neighbour lists: geometric ones for the constructors that work
+        # from coordinates, matrix-consistent ones for the local search
+        geo_candidates = None
+        candidates = None
+        if base_method in ('lin_kernighan', 'simulated_annealing', 'greedy_edge', 'kruskal'):
+            geo_candidates = self.get_candidate_graph(coordinates)
+        if dist_matrix is not None and base_method not in ('brute_force', 'held_karp', 'backtracking',
+                                                           'parallel_backtracking', 'branch_and_bound'):
+            candidates = self.get_candidate_graph(coordinates, dist_matrix)
+
+        if base_method == 'brute_force':
+            route, distance = self._solve_brute_force(dist_matrix, stats, deadline)
+        elif base_method == 'held_karp':
+            route, distance = self._solve_held_karp(dist_matrix, stats, deadline)
+        elif base_method == 'backtracking':
+            route, distance = self._solve_backtracking(dist_matrix, stats, deadline)
+        elif base_method == 'parallel_backtracking':
+            route, distance = self._solve_parallel_backtracking(dist_matrix, stats, deadline)
+        elif base_method == 'branch_and_bound':
+            route, distance = self._solve_branch_and_bound(dist_matrix, stats, deadline)
+        elif base_method == 'lin_kernighan':
+            # Greedy edge is a better starting tour for LK than nearest neighbor
+            route, _ = self._solve_greedy_edge(coordinates, geo_candidates)
+            route, distance = self._solve_lin_kernighan(dist_matrix, route, stats, deadline, candidates)
+        elif base_method == 'simulated_annealing':
+            route, _ = self._solve_greedy_edge(coordinates, geo_candidates)
+            route, distance = self._solve_simulated_annealing(dist_matrix, route, stats, deadline, candidates)
+        elif base_method == 'kruskal':
+            route, distance = self._solve_mst_tsp(coordinates, geo_candidates)
+        elif base_method == 'space_filling':
+            route, distance = self._solve_space_filling(coordinates)
+        elif base_method == 'greedy_edge':
+            route, distance = self._solve_greedy_edge(coordinates, geo_candidates)
+        elif base_method == 'nearest_neighbor_kdtree':
+            route, distance = self._solve_nearest_neighbor_kdtree(coordinates)
+        elif base_method == 'k_means':
+             route, distance = self._solve_nearest_neighbor(dist_matrix, candidates)
         else:
-            route, distance = self._solve_nearest_neighbor(dist_matrix)
+            route, distance = self._solve_nearest_neighbor(dist_matrix, candidates)
+
+        for improvement in improvements:
+            if self._expired(deadline):
+                stats['timed_out'] = True
+                break
+            if improvement in ('two_opt', '2opt'):
+                route, distance = self._improve_two_opt(dist_matrix, route, stats, deadline, candidates)
+            elif improvement in ('oropt', 'or_opt'):
+                route, distance = self._improve_or_opt(dist_matrix, route, stats, deadline=deadline,
+                                                       candidates=candidates)
+            elif improvement == 'oropt_best':
+                route, distance = self._improve_or_opt(dist_matrix, route, stats, best_improvement=True,
+                                                       deadline=deadline, candidates=candidates)
+
+        distance_source = self.distance_source if dist_matrix is not None else 'haversine'
+        if dist_matrix is not None and self.distance_backend is None and self.metric in self.APPROXIMATE_METRICS:
+            # Solved in the approximate metric, reported in haversine
+            stats['metric_distance'] = distance
+            stats['metric_max_rel_error'] = self.metric_error(coordinates)
+            distance = self.calculate_route_distance(coordinates, route)
+            distance_source = 'haversine'
+        elif dist_matrix is None and self.distance_backend is not None:
+            # Matrix-free constructors never see the road network: the tour is
+            # built on straight lines and only measured over roads
+            unused = (f"WARNING: '{stats.get('fallback_method', base_method)}' builds the tour from "
+                      f"straight-line distances, the road network only measures it.")
+            warning = f"{warning} {unused}" if warning else unused
+            distance = self.distance_backend.route_length(coordinates, route)
+            distance_source = self.distance_source
+        elif dist_matrix is None and self.metric == 'geodesic':
+            # Matrix-free constructors measure haversine
+            distance = geodesic_route_length(coordinates, route)
+            distance_source = 'geodesic'
 
         stats['execution_time'] = time.time() - start_time
         stats['n_points'] = n
+        stats['distance_source'] = distance_source
         stats['distance'] = distance
+        stats.setdefault('timed_out', False)
         if warning:
             stats['warning'] = warning
 
+        # A timed out tour depends on the budget, not only on the input
+        if tour_key is not None and not stats['timed_out']:
+            stats['cache_hit'] = False
+            self.cache.put(tour_key, (list(route), distance, dict(stats)), 8 * n + 1024)
+
         return route, distance, stats
 
-    def _solve_brute_force(self, dist_matrix: np.ndarray) -> Tuple[List[int], float]:
+    def _solve_brute_force(self, dist_matrix: np.ndarray, stats: Dict,
+                           deadline: Optional[float] = None) -> Tuple[List[int], float]:
         n = len(dist_matrix)
         points = list(range(n))
         start_node = points[0]
         rest = points[1:]
         
-        best_dist = float('inf')
-        best_route = None
-
-        for perm in permutations(rest):
-            route = [start_node] + list(perm)
-            dist = self.calculate_total_distance(dist_matrix, route)
-            if dist < best_dist:
-                best_dist = dist
-                best_route = route
+        # Nearest neighbor is the incumbent, so a deadline always has an answer
+        best_route, best_dist = self._solve_nearest_neighbor(dist_matrix)
+        best_route = [int(v) for v in best_route]
+        if n <= 3:
+            # Every tour of up to three nodes has the same length
+            return best_route, best_dist
+
+        # Permutations are scored in batches of 4096 tours, one gather each
+        perms = permutations(rest)
+        while True:
+            if self._expired(deadline):
+                stats['timed_out'] = True
+                break
+            batch = np.array(list(islice(perms, 4096)), dtype=np.int64).reshape(-1, n - 1)
+            if len(batch) == 0:
+                break
+            routes = np.column_stack((np.full(len(batch), start_node), batch))
+            dists = self.calculate_total_distances(dist_matrix, routes)
+            best = int(np.argmin(dists))
+            if dists[best] < best_dist:
+                best_dist = float(dists[best])
+                best_route = routes[best].tolist()
         
         return best_route, best_dist
 
-    def _solve_backtracking(self, dist_matrix: np.ndarray, stats: Dict) -> Tuple[List[int], float]:
+    def _solve_held_karp(self, dist_matrix: np.ndarray, stats: Dict,
+                         deadline: Optional[float] = None) -> Tuple[List[int], float]:
+        # Bitmask DP, O(n^2 * 2^n). Node 0 is the fixed start; bit b of a mask
+        # stands for node b + 1. dp[mask, j] is the cheapest path that leaves 0,
+        # visits every node in mask and ends at j.
         n = len(dist_matrix)
-        self._best_dist_bt = float('inf')
-        self._best_route_bt = None
-        self._nodes_explored = 0
-        self._prunes = 0
+        if n <= 3:
+            route = list(range(n))
+            return route, self.calculate_total_distance(dist_matrix, route) if n > 1 else 0.0
 
-        visited = [False] * n
-        current_route = [0]
-        visited[0] = True
+        m = n - 1
+        inner = dist_matrix[1:, 1:].astype(np.float32)
+        n_masks = 1 << m
 
-        self._backtrack_recursive(dist_matrix, visited, current_route, 0, n)
-        
-        stats['nodes_explored'] = self._nodes_explored
-        stats['prunes'] = self._prunes
-        return self._best_route_bt, self._best_dist_bt
-
-    def _backtrack_recursive(self, dist_matrix, visited, current_route, current_dist, n):
-        self._nodes_explored += 1
-        if current_dist >= self._best_dist_bt:
-            self._prunes += 1
-            return
+        dp = np.full((n_masks, m), np.inf, dtype=np.float32)
+        parent = np.full((n_masks, m), -1, dtype=np.int8)
+        singles = 1 << np.arange(m)
+        dp[singles, np.arange(m)] = dist_matrix[0, 1:]
 
-        if len(current_route) == n:
-            total_dist = current_dist + dist_matrix[current_route[-1], current_route[0]]
-            if total_dist < self._best_dist_bt:
-                self._best_dist_bt = total_dist
-                self._best_route_bt = current_route.copy()
-            return
+        # Group subsets by size so each layer only reads finished layers
+        masks = np.arange(n_masks, dtype=np.int64)
+        popcount = np.zeros(n_masks, dtype=np.int8)
+        for b in range(m):
+            popcount += ((masks >> b) & 1).astype(np.int8)
 
-        last_node = current_route[-1]
-        for i in range(n):
-            if not visited[i]:
-                dist_add = dist_matrix[last_node, i]
-                if current_dist + dist_add < self._best_dist_bt:
-                    visited[i] = True
-                    current_route.append(i)
-                    self._backtrack_recursive(dist_matrix, visited, current_route, current_dist + dist_add, n)
-                    current_route.pop()
-                    visited[i] = False
+        for size in range(2, m + 1):
+            if self._expired(deadline):
+                # No partial answer in a DP table, fall back to nearest neighbor
+                stats['timed_out'] = True
+                route, distance = self._solve_nearest_neighbor(dist_matrix)
+                return [int(v) for v in route], distance
+            layer = masks[popcount == size]
+            for j in range(m):
+                subset = layer[(layer >> j) & 1 == 1]
+                prev = subset ^ (1 << j)
+                # One vectorized min over every predecessor i of j
+                cand = dp[prev] + inner[:, j]
+                best = np.argmin(cand, axis=1)
+                dp[subset, j] = cand[np.arange(len(subset)), best]
+                parent[subset, j] = best
+
+        full = n_masks - 1
+        closing = dp[full] + dist_matrix[1:, 0].astype(np.float32)
+        last = int(np.argmin(closing))
+
+        # Walk the parent table back to the start
+        path = []
+        mask, j = full, last
+        while j != -1:
+            path.append(j + 1)
+            prev_j = int(parent[mask, j])
+            mask ^= 1 << j
+            j = prev_j
+
+        route = [0] + path[::-1]
+        # Report the distance in full precision, the table is only float32
+        return route, self.calculate_total_distance(dist_matrix, route)
+
+    def _solve_backtracking(self, dist_matrix: np.ndarray, stats: Dict,
+                            deadline: Optional[float] = None) -> Tuple[List[int], float]:
+        # Nearest neighbor seeds the incumbent, then the bitmask DFS engine
+        # proves (or improves) it
+        best_route, best_dist = self._solve_nearest_neighbor(dist_matrix)
+        best_route = [int(v) for v in best_route]
+
+        route, dist, nodes_explored, prunes, timed_out = backtrack_search(
+            dist_matrix.tolist(), [0], best_dist, deadline=deadline)
+        if route is not None:
+            best_route, best_dist = route, dist
+        if timed_out:
+            stats['timed_out'] = True
+
+        stats['nodes_explored'] = nodes_explored
+        stats['prunes'] = prunes
+        return best_route, self.calculate_total_distance(dist_matrix, best_route)
+
+    def _solve_parallel_backtracking(self, dist_matrix: np.ndarray, stats: Dict,
+                                     deadline: Optional[float] = None) -> Tuple[List[int], float]:
+        # Backtracking split by its first two levels: every (0, a, b) prefix is a
+        # task for the process pool. Workers share the incumbent length through a
+        # multiprocessing.Value seeded with the nearest neighbor tour.
+        n = len(dist_matrix)
+        best_route, best_dist = self._solve_nearest_neighbor(dist_matrix)
+        best_route = [int(v) for v in best_route]
+        nodes_explored = 0
+        prunes = 0
+
+        if n > 3:
+            prefixes = [[0, a, b] for a in range(1, n) for b in range(1, n) if a != b]
+            # Cheapest prefixes first: good tours (and tight bounds) show up early
+            prefixes.sort(key=lambda p: dist_matrix[p[0], p[1]] + dist_matrix[p[1], p[2]])
+            bound = multiprocessing.Value('d', best_dist)
+            with SharedMatrix(dist_matrix) as shared:
+                with ProcessPoolExecutor(max_workers=self.n_workers, initializer=init_shared_bound,
+                                         initargs=(bound,)) as pool:
+                    futures = [pool.submit(backtrack_branch, shared.name, shared.shape, shared.dtype,
+                                           prefix, deadline)
+                               for prefix in prefixes]
+                    results = [future.result() for future in futures]
+
+            for route, _, explored, pruned, timed_out in results:
+                nodes_explored += explored
+                prunes += pruned
+                if timed_out:
+                    stats['timed_out'] = True
+                if route is None:
+                    continue
+                # Measured here rather than trusted: several workers can tie
+                # on the shared bound with tours of different lengths
+                dist = self.calculate_total_distance(dist_matrix, route)
+                if dist < best_dist:
+                    best_route, best_dist = route, dist
+            stats['workers'] = self.n_workers
+            stats['tasks'] = len(prefixes)
+
+        stats['nodes_explored'] = nodes_explored
+        stats['prunes'] = prunes
+        return best_route, self.calculate_total_distance(dist_matrix, best_route)
+
+    @staticmethod
+    def _one_tree(weights: np.ndarray) -> Optional[np.ndarray]:
+        # Minimum 1-tree on a weight matrix where excluded edges are +inf and
+        # forced ones -inf: an MST over nodes 1..n-1 plus the two cheapest
+        # edges of node 0. Returns the (n, 2) edge list, or None when the
+        # exclusions leave no 1-tree at all. Prim on plain lists, faster
+        # than vectorized steps at the sizes branch and bound handles.
+        n = len(weights)
+        rows = weights.tolist()
+        key = rows[1][:]
+        best_from = [1] * n
+        rest = list(range(2, n))
+        edges = np.empty((n, 2), dtype=np.int64)
+        for e in range(n - 2):
+            v = min(rest, key=key.__getitem__)
+            if key[v] == np.inf:
+                return None
+            rest.remove(v)
+            edges[e] = (best_from[v], v)
+            row = rows[v]
+            for u in rest:
+                if row[u] < key[u]:
+                    key[u] = row[u]
+                    best_from[u] = v
+        row = weights[0, 1:]
+        two = np.argpartition(row, 1)[:2]
+        if row[two].max() == np.inf:
+            return None
+        edges[n - 2:, 0] = 0
+        edges[n - 2:, 1] = two + 1
+        return edges
+
+    def _one_tree_bound(self, dist_matrix: np.ndarray, pi: np.ndarray, forced: np.ndarray,
+                        excluded: np.ndarray, upper_bound: float, iterations: int,
+                        step: float, decay: float,
+                        deadline: Optional[float] = None) -> Tuple[float, np.ndarray, Optional[np.ndarray], Optional[List[int]]]:
+        # Held-Karp bound of the tours that use every forced edge and no
+        # excluded one: subgradient ascent on the node potentials pi of the
+        # Lagrangian 1-tree, starting from the given ones. With costs
+        # c'ij = cij + pi_i + pi_j every tour costs exactly 2 * sum(pi) more.
+        # Returns the bound, the best potentials, the 1-tree they give and,
+        # if that 1-tree is a tour (every degree 2), the tour, which is then
+        # optimal for this subproblem. Past the deadline the ascent stops
+        # after its first 1-tree; the best bound so far is still a bound.
+        n = len(dist_matrix)
+        best_bound, best_pi, best_edges = -np.inf, pi, None
+        for _ in range(iterations):
+            if best_edges is not None and self._expired(deadline):
+                break
+            weights = dist_matrix + pi[:, np.newaxis] + pi
+            weights[excluded] = np.inf
+            weights[forced] = -np.inf
+            np.fill_diagonal(weights, np.inf)
+            edges = self._one_tree(weights)
+            if edges is None:
+                return np.inf, pi, None, None
+            bound = float(np.sum(dist_matrix[edges[:, 0], edges[:, 1]] + pi[edges[:, 0]] + pi[edges[:, 1]])
+                          - 2 * pi.sum())
+            if bound > best_bound:
+                best_bound, best_pi, best_edges = bound, pi, edges
+            if best_bound >= upper_bound:
+                break
+
+            degree = np.bincount(edges.ravel(), minlength=n)
+            gap = degree - 2
+            norm = float(gap @ gap)
+            if norm == 0:
+                neighbours = [[] for _ in range(n)]
+                for a, b in edges:
+                    neighbours[a].append(int(b))
+                    neighbours[b].append(int(a))
+                tour, previous = [0], -1
+                while len(tour) < n:
+                    nxt = next(u for u in neighbours[tour[-1]] if u != previous)
+                    previous = tour[-1]
+                    tour.append(nxt)
+                return bound, pi, edges, tour
+            pi = pi + step * max(upper_bound - bound, 1e-9 * abs(upper_bound)) / norm * gap
+            step *= decay
+        return best_bound, best_pi, best_edges, None
+
+    @staticmethod
+    def _fix_edges(forced: np.ndarray, excluded: np.ndarray, new_forced: List[Tuple[int, int]],
+                   new_excluded: List[Tuple[int, int]]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        # Child constraints: a node with two forced edges loses all its other
+        # edges, and the edge that would close a forced path into a subtour
+        # is excluded. None when the constraints contradict each other.
+        forced = forced.copy()
+        excluded = excluded.copy()
+        n = len(forced)
+        for a, b in new_excluded:
+            if forced[a, b]:
+                return None
+            excluded[a, b] = excluded[b, a] = True
+        for a, b in new_forced:
+            if excluded[a, b]:
+                return None
+            forced[a, b] = forced[b, a] = True
+            for v in (a, b):
+                count = int(forced[v].sum())
+                if count > 2:
+                    return None
+                if count == 2:
+                    excluded[v] |= ~forced[v]
+                    excluded[:, v] |= ~forced[:, v]
+            # Ends of the forced path through (a, b)
+            ends = []
+            for v, previous in ((a, b), (b, a)):
+                length = 1
+                while True:
+                    nxt = [u for u in np.flatnonzero(forced[v]) if u != previous]
+                    if not nxt:
+                        break
+                    previous, v = v, int(nxt[0])
+                    length += 1
+                    if v in (a, b):
+                        return None
+                ends.append((v, length))
+            (x, _), (y, _) = ends
+            # A lone edge has nothing to close
+            if 2 < ends[0][1] + ends[1][1] < n:
+                if forced[x, y]:
+                    return None
+                excluded[x, y] = excluded[y, x] = True
+        np.fill_diagonal(excluded, False)
+        return forced, excluded
+
+    def _solve_branch_and_bound(self, dist_matrix: np.ndarray, stats: Dict,
+                                deadline: Optional[float] = None,
+                                node_iterations: int = 25) -> Tuple[List[int], float]:
+        # Held-Karp 1-tree branch and bound (Volgenant & Jonker). Each node is
+        # a set of forced and excluded edges, bounded by its Lagrangian 1-tree
+        # with the potentials refined from its parent's. Branching picks a
+        # node of degree > 2 in the 1-tree and two of its free tree edges
+        # e1, e2: exclude e1 | force e1, exclude e2 | force both.
+        n = len(dist_matrix)
+        nodes_explored = 0
+        prunes = 0
+
+        # Nearest neighbor polished by 2-opt and Or-opt gives the initial
+        # upper bound; the tighter it is, the more the bound prunes
+        best_route, best_dist = self._solve_nearest_neighbor(dist_matrix)
+        best_route = [int(v) for v in best_route]
+        if n > 4:
+            scratch = {}
+            best_route, _ = self._improve_two_opt(dist_matrix, best_route, scratch, deadline)
+            best_route, best_dist = self._improve_or_opt(dist_matrix, best_route, scratch, deadline=deadline)
+            best_route = [int(v) for v in best_route]
+
+        if n > 3:
+            dist_matrix = np.asarray(dist_matrix, dtype=np.float64)
+            eps = 1e-9 * max(best_dist, 1.0)
+            no_edges = np.zeros((n, n), dtype=bool)
+
+            def evaluate(pi, forced, excluded, iterations, step, decay):
+                nonlocal best_route, best_dist, nodes_explored
+                nodes_explored += 1
+                bound, pi, edges, tour = self._one_tree_bound(dist_matrix, pi, forced, excluded,
+                                                              best_dist - eps, iterations, step, decay,
+                                                              deadline)
+                if tour is not None:
+                    total = self.calculate_total_distance(dist_matrix, tour)
+                    if total < best_dist:
+                        best_route, best_dist = tour, total
+                    return None
+                if bound >= best_dist - eps:
+                    return None
+                return bound, pi, edges
+
+            counter = 0
+            heap = []
+            root = evaluate(np.zeros(n), no_edges, no_edges, 300, 2.0, 0.98)
+            if root is not None:
+                heap.append((root[0], counter, root[1], root[2], no_edges, no_edges))
+            while heap:
+                if self._expired(deadline):
+                    stats['timed_out'] = True
+                    break
+                bound, _, pi, edges, forced, excluded = heapq.heappop(heap)
+                if bound >= best_dist - eps:
+                    prunes += 1
+                    continue
+
+                degree = np.bincount(edges.ravel(), minlength=n)
+                v = int(np.argmax(degree))
+                incident = [int(b if a == v else a) for a, b in edges if a == v or b == v]
+                free = [u for u in incident if not forced[v, u]]
+                # The costliest free edges are the likeliest to leave the tour
+                free.sort(key=lambda u: dist_matrix[v, u] + pi[u], reverse=True)
+                e1, e2 = free[0], free[1] if len(free) > 1 else None
+
+                children = [([], [(v, e1)])]
+                if e2 is not None:
+                    children.append(([(v, e1)], [(v, e2)]))
+                    if not forced[v].any():
+                        children.append(([(v, e1), (v, e2)], []))
                 else:
-                    self._prunes += 1
+                    children.append(([(v, e1)], []))
+                for new_forced, new_excluded in children:
+                    fixed = self._fix_edges(forced, excluded, new_forced, new_excluded)
+                    if fixed is None:
+                        continue
+                    child = evaluate(pi, fixed[0], fixed[1], node_iterations, 2.0, 0.9)
+                    if child is None:
+                        prunes += 1
+                        continue
+                    counter += 1
+                    heapq.heappush(heap, (max(child[0], bound), counter, child[1], child[2], *fixed))
+
+        stats['nodes_explored'] = nodes_explored
+        stats['prunes'] = prunes
+        return best_route, self.calculate_total_distance(dist_matrix, best_route)
 
-    def _solve_nearest_neighbor(self, dist_matrix: np.ndarray) -> Tuple[List[int], float]:
+    def _solve_nearest_neighbor(self, dist_matrix: np.ndarray,
+                                candidates: Optional[CandidateGraph] = None) -> Tuple[List[int], float]:
         n = len(dist_matrix)
-        visited = [False] * n
+        # The first unvisited candidate is the nearest unvisited node, since
+        # the lists hold the k closest in order; only when all of them are
+        # taken does the step scan the full row
+        neighbors = candidates.as_array() if candidates is not None and candidates.k > 0 else None
+        # Boolean array, np.where would convert a Python list on every step
+        visited = np.zeros(n, dtype=bool)
         route = [0]
         visited[0] = True
         distance = 0
@@ -166,6 +910,17 @@ class TSPService:
         for _ in range(n - 1):
             min_dist = float('inf')
             next_node = -1
+
+            if neighbors is not None:
+                cand = neighbors[current]
+                free = cand[~visited[cand]]
+                if len(free):
+                    next_node = free[0]
+                    route.append(next_node)
+                    visited[next_node] = True
+                    distance += dist_matrix[current, next_node]
+                    current = next_node
+                    continue
             
             # Vectorized search for nearest neighbor
             # Get row for current node
@@ -187,57 +942,531 @@ class TSPService:
         distance += dist_matrix[current, 0]
         return route, distance
 
-    def _solve_mst_tsp(self, dist_matrix: np.ndarray) -> Tuple[List[int], float]:
+    def _solve_nearest_neighbor_kdtree(self, coordinates: np.ndarray) -> Tuple[List[int], float]:
+        # Same walk as _solve_nearest_neighbor (chord order on the unit sphere is
+        # haversine order) but backed by a KD-tree instead of an N x N matrix
+        route = nearest_neighbor_order(to_unit_vectors(coordinates), start=0).tolist()
+        return route, self.calculate_route_distance(coordinates, route)
+
+    def _solve_space_filling(self, coordinates: np.ndarray) -> Tuple[List[int], float]:
+        # Visit the points in Hilbert curve order, rotated to start at node 0
+        order = hilbert_order(coordinates)
+        start = int(np.flatnonzero(order == 0)[0])
+        route = np.roll(order, -start).tolist()
+        return route, self.calculate_route_distance(coordinates, route)
+
+    def _solve_greedy_edge(self, coordinates: np.ndarray,
+                           candidates: Optional[CandidateGraph] = None) -> Tuple[List[int], float]:
+        # Greedy matching: take candidate edges shortest first whenever both ends
+        # still have degree < 2 and no cycle closes (union-find). The leftover
+        # path fragments are joined the same way over the k-NN graph of their
+        # endpoints until a single Hamiltonian path is left, which is then closed.
+        n = len(coordinates)
+        if n <= 3:
+            route = list(range(n))
+            return route, self.calculate_route_distance(coordinates, route) if n > 1 else 0.0
+
+        points = to_unit_vectors(coordinates)
+        degree = np.zeros(n, dtype=np.int64)
+        adj = np.full((n, 2), -1, dtype=np.int64)
+        parent = list(range(n))
+
+        def find(v: int) -> int:
+            root = v
+            while parent[root] != root:
+                root = parent[root]
+            while parent[v] != root:
+                parent[v], v = root, parent[v]
+            return root
+
+        def add_edges(rows: np.ndarray, cols: np.ndarray, dists: np.ndarray) -> int:
+            added = 0
+            for e in np.argsort(dists, kind='stable'):
+                u, v = int(rows[e]), int(cols[e])
+                if degree[u] >= 2 or degree[v] >= 2:
+                    continue
+                ru, rv = find(u), find(v)
+                if ru == rv:
+                    continue
+                parent[ru] = rv
+                adj[u, degree[u]] = v
+                adj[v, degree[v]] = u
+                degree[u] += 1
+                degree[v] += 1
+                added += 1
+            return added
+
+        def endpoint_edges(nodes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+            rows, cols, dists = knn_edges(points[nodes], k)
+            return nodes[rows], nodes[cols], dists
+
+        if candidates is None:
+            candidates = CandidateGraph.from_coordinates(coordinates, self.n_neighbors)
+        n_edges = add_edges(*candidates.edges())
+        k = self.n_neighbors
+        while n_edges < n - 1:
+            endpoints = np.flatnonzero(degree < 2)
+            added = add_edges(*endpoint_edges(endpoints, min(k, len(endpoints) - 1)))
+            n_edges += added
+            if added == 0:
+                # Only same-fragment endpoints were in reach, widen the search
+                k *= 2
+
+        # Walk the Hamiltonian path from one end, then rotate so node 0 starts
+        end = int(np.flatnonzero(degree < 2)[0])
+        path = np.empty(n, dtype=np.int64)
+        prev, current = -1, end
+        for i in range(n):
+            path[i] = current
+            a, b = adj[current]
+            prev, current = current, (b if a == prev else a)
+        start = int(np.flatnonzero(path == 0)[0])
+        route = np.roll(path, -start).tolist()
+        return route, self.calculate_route_distance(coordinates, route)
+
+    def _neighbor_lists(self, dist_matrix: np.ndarray,
+                        candidates: Optional[CandidateGraph] = None) -> np.ndarray:
+        # k nearest candidates of every node, closest first
+        if candidates is None:
+            candidates = CandidateGraph.from_distance_matrix(dist_matrix, self.n_neighbors)
+        return candidates.as_array()
+
+    @staticmethod
+    def _reverse_segment(tour: np.ndarray, pos: np.ndarray, x: int, y: int):
+        # 2-opt move on the edges (tour[x], tour[x+1]) and (tour[y], tour[y+1]), x < y.
+        # Reversing the outside part instead gives the same cycle, so take the shorter.
+        n = len(tour)
+        inner = y - x
+        if inner <= n - inner:
+            idx = np.arange(x + 1, y + 1)
+        else:
+            idx = np.arange(y + 1, x + 1 + n) % n
+        tour[idx] = tour[idx[::-1]]
+        pos[tour[idx]] = idx
+
+    def _improve_two_opt(self, dist_matrix: np.ndarray, route: List[int], stats: Dict,
+                         deadline: Optional[float] = None,
+                         candidates: Optional[CandidateGraph] = None) -> Tuple[List[int], float]:
+        n = len(route)
+        if n < 5:
+            return route, self.calculate_total_distance(dist_matrix, route)
+
+        tour = np.array(route, dtype=np.int64)
+        pos = np.empty(n, dtype=np.int64)
+        pos[tour] = np.arange(n)
+        neighbors = self._neighbor_lists(dist_matrix, candidates)
+
+        # Don't-look bits: only nodes next to a recent change get re-examined
+        queue = deque(int(v) for v in tour)
+        in_queue = np.ones(n, dtype=bool)
+
+        start_time = time.time()
+        moves = 0
+        gain = 0.0
+        while queue and moves < self.local_search_iterations:
+            if self.local_search_time_limit is not None and time.time() - start_time > self.local_search_time_limit:
+                break
+            if self._expired(deadline):
+                stats['timed_out'] = True
+                break
+            a = queue.popleft()
+            in_queue[a] = False
+
+            i = pos[a]
+            cand = neighbors[a]
+            pos_c = pos[cand]
+            a_next = tour[(i + 1) % n]
+            a_prev = tour[i - 1]
+            c_next = tour[(pos_c + 1) % n]
+            c_prev = tour[pos_c - 1]
+
+            # Deltas of a against all its candidates, both tour directions
+            d_ac = dist_matrix[a, cand]
+            delta_next = d_ac + dist_matrix[a_next, c_next] - dist_matrix[a, a_next] - dist_matrix[cand, c_next]
+            delta_prev = d_ac + dist_matrix[a_prev, c_prev] - dist_matrix[a_prev, a] - dist_matrix[c_prev, cand]
+
+            best_next = int(np.argmin(delta_next))
+            best_prev = int(np.argmin(delta_prev))
+            if delta_next[best_next] <= delta_prev[best_prev]:
+                delta = delta_next[best_next]
+                c = int(cand[best_next])
+                x, y = i, pos[c]
+                touched = (a, int(a_next), c, int(c_next[best_next]))
+            else:
+                delta = delta_prev[best_prev]
+                c = int(cand[best_prev])
+                x, y = (i - 1) % n, (pos[c] - 1) % n
+                touched = (a, int(a_prev), c, int(c_prev[best_prev]))
+
+            if delta >= -1e-10:
+                continue
+
+            if x > y:
+                x, y = y, x
+            self._reverse_segment(tour, pos, x, y)
+            moves += 1
+            gain -= delta
+            for v in touched:
+                if not in_queue[v]:
+                    in_queue[v] = True
+                    queue.append(v)
+
+        # Keep node 0 as the start of the route like every constructor does
+        start = pos[route[0]]
+        route = np.roll(tour, -start).tolist()
+        stats['two_opt_moves'] = moves
+        stats['two_opt_gain'] = float(gain)
+        return route, self.calculate_total_distance(dist_matrix, route)
+
+    def _best_relocation(self, dist_matrix: np.ndarray, tour: np.ndarray, pos: np.ndarray,
+                         neighbors: np.ndarray, i: int, k: int) -> Tuple[float, int, bool]:
+        # Best place to move the k nodes starting at position i. Insertion
+        # edges come from the neighbor lists of both segment ends, and every
+        # delta is O(1) from the distance matrix.
+        n = len(tour)
+        first = tour[i]
+        last = tour[(i + k - 1) % n]
+        before = tour[i - 1]
+        after = tour[(i + k) % n]
+        removal_gain = dist_matrix[before, first] + dist_matrix[last, after] - dist_matrix[before, after]
+
+        cand = np.concatenate((neighbors[first], neighbors[last]))
+        pos_c = pos[cand]
+        u = np.concatenate((cand, tour[pos_c - 1]))
+        v = np.concatenate((tour[(pos_c + 1) % n], cand))
+        valid = ((pos[u] - i) % n >= k) & ((pos[v] - i) % n >= k)
+        if not valid.any():
+            return 0.0, -1, False
+        u = u[valid]
+        v = v[valid]
+
+        base = -dist_matrix[u, v] - removal_gain
+        delta_fwd = base + dist_matrix[u, first] + dist_matrix[last, v]
+        delta_rev = base + dist_matrix[u, last] + dist_matrix[first, v]
+        best_fwd = int(np.argmin(delta_fwd))
+        best_rev = int(np.argmin(delta_rev))
+        if delta_fwd[best_fwd] <= delta_rev[best_rev]:
+            return float(delta_fwd[best_fwd]), int(u[best_fwd]), False
+        return float(delta_rev[best_rev]), int(u[best_rev]), True
+
+    @staticmethod
+    def _relocate_segment(tour: np.ndarray, i: int, k: int, target: int, reverse: bool) -> np.ndarray:
+        # Move the segment at positions i..i+k-1 right after node `target`
+        rotated = np.roll(tour, -i)
+        segment = rotated[:k][::-1] if reverse else rotated[:k]
+        rest = rotated[k:]
+        cut = int(np.flatnonzero(rest == target)[0]) + 1
+        return np.concatenate((rest[:cut], segment, rest[cut:]))
+
+    def _improve_or_opt(self, dist_matrix: np.ndarray, route: List[int], stats: Dict,
+                        best_improvement: bool = False,
+                        deadline: Optional[float] = None,
+                        candidates: Optional[CandidateGraph] = None) -> Tuple[List[int], float]:
+        # Or-opt: relocate segments of 1-3 consecutive nodes, optionally reversed.
+        # First-improvement applies the first improving move of a node; best-improvement
+        # scans every active node and applies only the best move found. Both use
+        # don't-look bits keyed by the node a segment starts at.
+        n = len(route)
+        if n < 5:
+            return route, self.calculate_total_distance(dist_matrix, route)
+
+        tour = np.array(route, dtype=np.int64)
+        pos = np.empty(n, dtype=np.int64)
+        pos[tour] = np.arange(n)
+        neighbors = self._neighbor_lists(dist_matrix, candidates)
+        max_segment = min(3, n - 3)
+        active = np.ones(n, dtype=bool)
+
+        def best_move(a: int):
+            best = (-1e-10, None)
+            for k in range(1, max_segment + 1):
+                delta, target, reverse = self._best_relocation(dist_matrix, tour, pos, neighbors, pos[a], k)
+                if delta < best[0]:
+                    best = (delta, (k, target, reverse))
+                    if not best_improvement:
+                        break
+            return best
+
+        start_time = time.time()
+        moves = 0
+        gain = 0.0
+        while active.any() and moves < self.local_search_iterations:
+            if self.local_search_time_limit is not None and time.time() - start_time > self.local_search_time_limit:
+                break
+            if self._expired(deadline):
+                stats['timed_out'] = True
+                break
+
+            chosen = (-1e-10, None, -1)
+            for a in tour[active[tour]]:
+                if self._expired(deadline):
+                    # Out of time mid-scan: apply the best move found so far
+                    stats['timed_out'] = True
+                    break
+                a = int(a)
+                delta, move = best_move(a)
+                if move is None:
+                    active[a] = False
+                elif delta < chosen[0]:
+                    chosen = (delta, move, a)
+                    if not best_improvement:
+                        break
+
+            delta, move, a = chosen
+            if move is None:
+                break
+            k, target, reverse = move
+            i = pos[a]
+            touched = [tour[i - 1], tour[(i + k) % n], target, tour[(pos[target] + 1) % n]]
+            touched.extend(tour[(i + np.arange(k)) % n])
+            tour = self._relocate_segment(tour, i, k, target, reverse)
+            pos[tour] = np.arange(n)
+            active[touched] = True
+            moves += 1
+            gain -= delta
+
+        start = pos[route[0]]
+        route = np.roll(tour, -start).tolist()
+        stats['or_opt_moves'] = moves
+        stats['or_opt_gain'] = float(gain)
+        return route, self.calculate_total_distance(dist_matrix, route)
+
+    def _lk_chain(self, dist_matrix: np.ndarray, tour: _ArrayTour, neighbors: np.ndarray,
+                  t1: int, t2: int, t3: int, gain: float, max_depth: int) -> Tuple[float, List[int]]:
+        # Variable-depth search as a sequence of 2-opt flips. Each step removes
+        # (t3, t4), adds (t2, t3) and leaves the tour closed by (t4, t1); the chain
+        # is then rolled back to its best prefix.
+        flips = []
+        touched = [t1, t2]
+        added = set()
+        best_gain = 0.0
+        best_len = 0
+        for _ in range(max_depth):
+            forward = tour.next(t1) == t2
+            t4 = tour.prev(t3) if forward else tour.next(t3)
+            flips.append(tour.flip(t2, t4) if forward else tour.flip(t4, t2))
+            gain += dist_matrix[t3, t4] - dist_matrix[t2, t3]
+            added.add((min(t2, t3), max(t2, t3)))
+            touched.extend((t3, t4))
+
+            closed = gain - dist_matrix[t4, t1]
+            if closed > best_gain + 1e-10:
+                best_gain = closed
+                best_len = len(flips)
+
+            t2 = t4
+            forward = tour.next(t1) == t2
+            next_t3 = None
+            best_value = -np.inf
+            for c in neighbors[t2]:
+                c = int(c)
+                partial = gain - dist_matrix[t2, c]
+                if partial <= 0:
+                    break
+                if c == t1:
+                    continue
+                c4 = tour.prev(c) if forward else tour.next(c)
+                if c4 == t2 or (min(c, c4), max(c, c4)) in added:
+                    continue
+                value = partial + dist_matrix[c, c4]
+                if value > best_value:
+                    best_value = value
+                    next_t3 = c
+            if next_t3 is None:
+                break
+            t3 = next_t3
+
+        for start, length in reversed(flips[best_len:]):
+            tour.reverse_range(start, length)
+        return best_gain, touched
+
+    def _or3opt_move(self, dist_matrix: np.ndarray, tour: _ArrayTour, neighbors: np.ndarray,
+                     t1: int, t2: int, forward: bool) -> Tuple[float, List[int]]:
+        # Sequential 3-opt "or" move for when t4 sits on the wrong side of t3:
+        # remove (t1,t2), (t3,t4), (t5,t6), add (t2,t3), (t4,t5), (t6,t1). It swaps
+        # two adjacent segments without reversing either.
+        step = tour.next if forward else tour.prev
+        g0 = dist_matrix[t1, t2]
+        for t3 in neighbors[t2]:
+            t3 = int(t3)
+            g1 = g0 - dist_matrix[t2, t3]
+            if g1 <= 0:
+                break
+            if t3 == t1:
+                continue
+            t4 = step(t3)
+            if t4 == t1 or t3 == step(t2):
+                continue
+            g1 += dist_matrix[t3, t4]
+            for t5 in neighbors[t4]:
+                t5 = int(t5)
+                g2 = g1 - dist_matrix[t4, t5]
+                if g2 <= 0:
+                    break
+                if t5 == t3:
+                    continue
+                on_path = tour.between(t2, t5, t3) if forward else tour.between(t3, t5, t2)
+                if not on_path:
+                    continue
+                t6 = step(t5)
+                gain = g2 + dist_matrix[t5, t6] - dist_matrix[t6, t1]
+                if gain <= 1e-10:
+                    continue
+                if forward:
+                    start = int(tour.pos[t2])
+                    first_len = int((tour.pos[t5] - start) % tour.n) + 1
+                    total_len = int((tour.pos[t3] - start) % tour.n) + 1
+                else:
+                    start = int(tour.pos[t3])
+                    first_len = int((tour.pos[t6] - start) % tour.n) + 1
+                    total_len = int((tour.pos[t2] - start) % tour.n) + 1
+                tour.swap_adjacent(start, first_len, total_len)
+                return gain, [t1, t2, t3, t4, t5, t6]
+        return 0.0, []
+
+    def _lk_step(self, dist_matrix: np.ndarray, tour: _ArrayTour, neighbors: np.ndarray,
+                 t1: int, breadth: int = 5, max_depth: int = 50) -> Tuple[float, List[int]]:
+        for forward in (True, False):
+            t2 = tour.next(t1) if forward else tour.prev(t1)
+            tried = 0
+            for t3 in neighbors[t2]:
+                t3 = int(t3)
+                if dist_matrix[t1, t2] - dist_matrix[t2, t3] <= 0 or tried >= breadth:
+                    break
+                t4 = tour.prev(t3) if forward else tour.next(t3)
+                if t3 == t1 or t4 == t2:
+                    continue
+                tried += 1
+                gain, touched = self._lk_chain(dist_matrix, tour, neighbors, t1, t2, t3,
+                                               dist_matrix[t1, t2], max_depth)
+                if gain > 0:
+                    return gain, touched
+            gain, touched = self._or3opt_move(dist_matrix, tour, neighbors, t1, t2, forward)
+            if gain > 0:
+                return gain, touched
+        return 0.0, []
+
+    def _lk_optimize(self, dist_matrix: np.ndarray, tour: _ArrayTour, neighbors: np.ndarray,
+                     queue: deque, deadline: float) -> Tuple[float, int]:
+        # Runs LK steps until no queued node improves (don't-look bits) or time runs out
+        in_queue = np.zeros(tour.n, dtype=bool)
+        in_queue[list(queue)] = True
+        total_gain = 0.0
+        improvements = 0
+        while queue and time.time() < deadline:
+            t1 = queue.popleft()
+            in_queue[t1] = False
+            gain, touched = self._lk_step(dist_matrix, tour, neighbors, t1)
+            if gain <= 0:
+                continue
+            total_gain += gain
+            improvements += 1
+            for v in [t1] + touched:
+                if not in_queue[v]:
+                    in_queue[v] = True
+                    queue.append(v)
+        return total_gain, improvements
+
+    def _solve_lin_kernighan(self, dist_matrix: np.ndarray, route: List[int], stats: Dict,
+                             deadline: Optional[float] = None,
+                             candidates: Optional[CandidateGraph] = None) -> Tuple[List[int], float]:
+        # Chained Lin-Kernighan: LK local search from the given tour, then local
+        # double-bridge kicks until the time budget is spent.
+        n = len(dist_matrix)
+        distance = self.calculate_total_distance(dist_matrix, route)
+        if n < 5:
+            return route, distance
+
+        lk_deadline = time.time() + self.lin_kernighan_time_limit
+        # A tighter request deadline cuts the search short: that is a time out
+        budget_bound = deadline is not None and deadline < lk_deadline
+        deadline = min(lk_deadline, deadline) if deadline is not None else lk_deadline
+        neighbors = self._neighbor_lists(dist_matrix, candidates)
+        tour = _ArrayTour(route)
+        gain, improvements = self._lk_optimize(dist_matrix, tour, neighbors, deque(route), deadline)
+        best_tour = tour.tour.copy()
+        best_dist = distance - gain
+
+        kicks = 0
+        rng = np.random.RandomState(42)
+        segment = max(1, min(50, n // 4))
+        while n >= 8 and time.time() < deadline:
+            kicks += 1
+            # Double bridge on three short consecutive segments: A B C D -> A C B D
+            t = np.roll(best_tour, -rng.randint(n))
+            p1 = rng.randint(1, segment + 1)
+            p2 = p1 + rng.randint(1, segment + 1)
+            p3 = p2 + rng.randint(1, segment + 1)
+            ends = [t[p1 - 1], t[p1], t[p2 - 1], t[p2], t[p3 - 1], t[p3 % n]]
+            delta = (dist_matrix[ends[0], ends[3]] + dist_matrix[ends[4], ends[1]] + dist_matrix[ends[2], ends[5]]
+                     - dist_matrix[ends[0], ends[1]] - dist_matrix[ends[2], ends[3]] - dist_matrix[ends[4], ends[5]])
+            tour = _ArrayTour(np.concatenate((t[:p1], t[p2:p3], t[p1:p2], t[p3:])))
+            gain, steps = self._lk_optimize(dist_matrix, tour, neighbors, deque(int(v) for v in ends), deadline)
+            candidate = best_dist + delta - gain
+            if candidate < best_dist - 1e-10:
+                best_dist = candidate
+                best_tour = tour.tour.copy()
+                improvements += steps
+
+        start = int(np.flatnonzero(best_tour == 0)[0])
+        route = np.roll(best_tour, -start).tolist()
+        stats['lk_improvements'] = improvements
+        stats['lk_kicks'] = kicks
+        if budget_bound and self._expired(deadline):
+            stats['timed_out'] = True
+        return route, self.calculate_total_distance(dist_matrix, route)
+
+    def _solve_simulated_annealing(self, dist_matrix: np.ndarray, route: List[int], stats: Dict,
+                                   deadline: Optional[float] = None,
+                                   candidates: Optional[CandidateGraph] = None) -> Tuple[List[int], float]:
+        # Multi-start annealing: independent chains (different seeds) from the
+        # same starting tour on a process pool, keeping the best result
         n = len(dist_matrix)
+        if n < 5:
+            return route, self.calculate_total_distance(dist_matrix, route)
+
+        time_limit = self.annealing_time_limit
+        if deadline is not None:
+            remaining = max(0.0, deadline - time.time())
+            time_limit = remaining if time_limit is None else min(time_limit, remaining)
+
+        neighbors = self._neighbor_lists(dist_matrix, candidates)
+        # A condensed matrix is shared as its 1-D triangle and rebuilt in the workers
+        shared_values = dist_matrix.values if isinstance(dist_matrix, CondensedDistanceMatrix) else dist_matrix
+        with SharedMatrix(shared_values) as shared:
+            with ProcessPoolExecutor(max_workers=self.annealing_chains) as pool:
+                futures = [
+                    pool.submit(annealing_chain, shared.name, shared.shape, shared.dtype, route,
+                                neighbors, seed, self.annealing_iterations, time_limit)
+                    for seed in range(self.annealing_chains)
+                ]
+                results = [future.result() for future in futures]
+
+        best_route, best_dist, _ = min(results, key=lambda result: result[1])
+        start = best_route.index(route[0])
+        best_route = best_route[start:] + best_route[:start]
+        stats['chains'] = [chain_stats for _, _, chain_stats in results]
+        # Chains cut short by annealing_time_limit alone are not a timeout
+        if self._expired(deadline):
+            stats['timed_out'] = True
+        return best_route, self.calculate_total_distance(dist_matrix, best_route)
+
+    def _solve_mst_tsp(self, coordinates: np.ndarray,
+                       candidates: Optional[CandidateGraph] = None) -> Tuple[List[int], float]:
+        # Double-tree 2-approximation without an N x N matrix: Euclidean MST of
+        # the unit-sphere vectors (same tree as haversine) over a sparse k-NN
+        # candidate graph, then an iterative preorder walk.
+        n = len(coordinates)
         if n <= 1:
             return [0], 0.0
-            
-        # 1. Build MST (Prim's Algorithm) using distance matrix
-        key = [float('inf')] * n
-        parent = [-1] * n
-        key[0] = 0
-        mst_set = [False] * n
-        
-        adj = {i: [] for i in range(n)}
-        
-        for _ in range(n):
-            # Pick min key vertex
-            # Simple linear scan O(N) -> Total O(N^2)
-            u = -1
-            min_val = float('inf')
-            for v in range(n):
-                if not mst_set[v] and key[v] < min_val:
-                    min_val = key[v]
-                    u = v
-            
-            if u == -1: break
-            mst_set[u] = True
-            
-            if parent[u] != -1:
-                adj[u].append(parent[u])
-                adj[parent[u]].append(u)
-                
-            # Update adjacent vertices
-            for v in range(n):
-                if not mst_set[v]:
-                    dist = dist_matrix[u, v]
-                    if dist < key[v]:
-                        key[v] = dist
-                        parent[v] = u
-                        
-        # 2. DFS Preorder
-        visited = [False] * n
-        tour = []
-        
-        def dfs(u):
-            visited[u] = True
-            tour.append(u)
-            for v in adj[u]:
-                if not visited[v]:
-                    dfs(v)
-                    
-        dfs(0)
-        
-        # 3. Calculate total distance
-        total_dist = self.calculate_total_distance(dist_matrix, tour)
+
+        points = to_unit_vectors(coordinates)
+        edges = None
+        if candidates is not None:
+            rows, cols, km = candidates.edges()
+            edges = (rows, cols, km_to_chord(km))
+        tree = euclidean_mst(points, k=self.n_neighbors, edges=edges)
+        tour = preorder(tree, root=0).tolist()
+
+        total_dist = self.calculate_route_distance(coordinates, tour)
         return tour, total_dist
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
@@ -5,10 +6,17 @@ import os
 
 from infrastructure.api.routers import optimization
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Solver timings for n_clusters='auto' are measured in the background
+    optimization.warm_up_runtime_models()
+    yield
+
 app = FastAPI(
     title="RutaFix API",
     description="API para el sistema de optimización de rutas",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
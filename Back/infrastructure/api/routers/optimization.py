@@ -1,25 +1,63 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from typing import Optional, List
 import numpy as np
+import os
 import time
 
 from domain.services.tsp_service import TSPService
 from domain.services.clustering_service import ClusteringService
+from domain.services.clustering_registry import KMeansRegistry
+from domain.services.runtime_model import SolverRuntimeModel
+from domain.services.spatial_index import hilbert_order
+from domain.services.tsp_cache import TSPCache
+from domain.services.distance_backend import RoadNetworkBackend
 from infrastructure.persistence.csv_repository import CSVRepository
+from infrastructure.persistence.road_network_repository import RoadNetworkRepository
 from application.dtos.request_dtos import OptimizeRequest, ManualPoint
 from application.dtos.response_dtos import OptimizeResponse, ClusterResponse, StatsResponse
 
 router = APIRouter()
 
+# Shared by every request: repeated point sets skip the matrix and the solve
+tsp_cache = TSPCache(max_bytes=256 * 1024 * 1024)
+# Fitted clusterings: repeated point sets reuse centroids and labels, similar
+# ones warm-start K-Means from the previous centroids
+kmeans_registry = KMeansRegistry()
+
+# Road network for method='dijkstra' and road distances, loaded on first use
+# from ROAD_NETWORK_EDGES / ROAD_NETWORK_NODES (csv or parquet)
+_road_backend = None
+
+def get_road_backend() -> Optional[RoadNetworkBackend]:
+    global _road_backend
+    edges_path = os.environ.get('ROAD_NETWORK_EDGES')
+    nodes_path = os.environ.get('ROAD_NETWORK_NODES')
+    if not edges_path or not nodes_path:
+        return None
+    if _road_backend is None:
+        graph = RoadNetworkRepository(edges_path, nodes_path).load()
+        _road_backend = RoadNetworkBackend(graph)
+    return _road_backend
+
+def warm_up_runtime_models():
+    # Times the solvers method='auto' picks (exact, local search, KD-tree)
+    # for n_clusters='auto' off the request path, at startup
+    return SolverRuntimeModel.calibrate_in_background(TSPService(), ['auto'])
+
 @router.post("/optimize", response_model=OptimizeResponse)
 async def optimize(
     file: Optional[UploadFile] = File(None),
-    n_clusters: int = Form(5),
+    n_clusters: str = Form('5'), # An integer, or 'auto' to pick it within time_budget_ms
     method: str = Form('auto'),
     use_csv: bool = Form(False),
     date_filter: Optional[str] = Form(None),
     manual_points_json: Optional[str] = Form(None), # Receive as JSON string if sent via Form
-    max_points: int = Form(50)
+    max_points: int = Form(50),
+    spatial_sort: bool = Form(False), # Hilbert curve pre-sort of the loaded points
+    time_budget_ms: Optional[float] = Form(None), # Deadline for the whole TSP stage
+    metric: str = Form('haversine'), # haversine, geodesic, equirectangular or euclidean
+    clustering_backend: str = Form('kmeans'), # kmeans or minibatch (streams the CSV)
+    max_cluster_size: Optional[int] = Form(None) # Balanced clustering, e.g. 18 so 'auto' solves every cluster exactly
 ):
     try:
         start_time = time.time()
@@ -28,6 +66,21 @@ async def optimize(
         repo = CSVRepository()
         coords = None
         names = None
+        # max_points <= 0 loads the whole CSV
+        csv_max_points = max_points if max_points > 0 else None
+        if n_clusters != 'auto':
+            try:
+                n_clusters = int(n_clusters)
+            except ValueError:
+                raise ValueError(f"n_clusters must be an integer or 'auto', got '{n_clusters}'")
+        tsp_service = TSPService(cache=tsp_cache, distance_backend=get_road_backend(), metric=metric)
+        # n_clusters='auto' sizes the clusters for the TSP stage to fit the time budget
+        cluster_service = ClusteringService(n_clusters=n_clusters, clustering_backend=clustering_backend,
+                                            max_cluster_size=max_cluster_size,
+                                            runtime_model=SolverRuntimeModel(tsp_service, method),
+                                            latency_budget_ms=time_budget_ms or 1000.0,
+                                            registry=kmeans_registry)
+        clustering_time = 0.0
 
         # Handle Manual Points
         if manual_points_json:
@@ -38,8 +91,30 @@ async def optimize(
             coords = np.array(coords_list)
         
         # Handle CSV
+        elif use_csv and clustering_backend == 'minibatch' and not cluster_service.auto:
+            # MiniBatch K-Means learns from the chunks as they are read; only
+            # the coordinates are kept for labelling and the TSP stage
+            coord_chunks = []
+            names = []
+
+            def stream():
+                for chunk_coords, chunk_names in repo.iter_chunks(date_filter=date_filter,
+                                                                  max_points=csv_max_points):
+                    coord_chunks.append(chunk_coords)
+                    names.extend(chunk_names)
+                    yield chunk_coords
+
+            clustering_start = time.time()
+            cluster_service.fit_stream(stream())
+            clustering_time = time.time() - clustering_start
+            coords = np.vstack(coord_chunks)
+            if spatial_sort:
+                order = hilbert_order(coords)
+                coords = coords[order]
+                names = [names[i] for i in order]
+
         elif use_csv:
-            coords, names = repo.load_data(date_filter=date_filter, max_points=max_points)
+            coords, names = repo.load_data(date_filter=date_filter, max_points=csv_max_points, spatial_sort=spatial_sort)
             
         # Handle File Upload
         elif file:
@@ -51,7 +126,7 @@ async def optimize(
                 # For simplicity, let's assume Excel upload as per original app
                 pass
             else:
-                coords, names = repo.load_from_excel(content, max_points=max_points)
+                coords, names = repo.load_from_excel(content, max_points=max_points, spatial_sort=spatial_sort)
         
         # Handle Random/Default
         if coords is None:
@@ -89,25 +164,38 @@ async def optimize(
                              break
              
              coords = np.array(coords_list)
+             if spatial_sort:
+                 coords = coords[hilbert_order(coords)]
              names = [f"Punto_MacroRegion_{i+1}" for i in range(count)]
 
         # Clustering
         # Ensure n_clusters is not greater than n_points
         n_points = len(coords)
-        if n_clusters > n_points:
+        if cluster_service.model is not None:
+            # Already fitted on the stream, which caps n_clusters itself
+            n_clusters = cluster_service.n_clusters
+        elif not cluster_service.auto and n_clusters > n_points:
             n_clusters = max(1, n_points)
+            cluster_service.n_clusters = n_clusters
             
         clustering_start = time.time()
-        cluster_service = ClusteringService(n_clusters=n_clusters)
         clusters_data = cluster_service.get_clusters(coords, names)
-        clustering_time = time.time() - clustering_start
+        clustering_time += time.time() - clustering_start
+        clustering_stats = cluster_service.get_stats()
+        # Balanced clustering may need more clusters than requested, 'auto'
+        # has chosen its own
+        n_clusters = cluster_service.n_clusters
 
         # TSP per cluster
         tsp_start = time.time()
-        tsp_service = TSPService()
+        cache_before = tsp_cache.get_stats()
         
         final_route_indices = []
         total_distance = 0
+        timed_out = False
+        metric_error = 0.0
+        # Distinct solver warnings, e.g. a road network the method cannot use
+        solver_warnings = []
         
         # Sort clusters (nearest neighbor of centroids)
         # For now, just iterate 0..k
@@ -116,10 +204,24 @@ async def optimize(
         colores = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8',
                    '#F7DC6F', '#BB8FCE', '#85C1E2', '#F8B739', '#52B788']
 
+        # Points in the clusters not solved yet
+        points_left = sum(len(cluster['coords']) for cluster in clusters_data)
+
         for i, cluster in enumerate(clusters_data):
             cluster_coords = np.array(cluster['coords'])
-            # Solve TSP for this cluster
-            route_local_indices, dist, _ = tsp_service.solve(cluster_coords, method)
+            # Each cluster gets the share of what is left of the budget that
+            # its size is of the points left, so an early large cluster cannot
+            # starve the later ones; time a cluster does not use rolls over
+            cluster_budget = None
+            if time_budget_ms is not None:
+                budget_left = max(0.0, time_budget_ms - (time.time() - tsp_start) * 1000)
+                cluster_budget = budget_left * len(cluster_coords) / max(points_left, 1)
+            points_left -= len(cluster_coords)
+            route_local_indices, dist, cluster_stats = tsp_service.solve(cluster_coords, method, time_budget_ms=cluster_budget)
+            timed_out = timed_out or cluster_stats['timed_out']
+            if cluster_stats.get('warning') and cluster_stats['warning'] not in solver_warnings:
+                solver_warnings.append(cluster_stats['warning'])
+            metric_error = max(metric_error, cluster_stats.get('metric_max_rel_error', 0.0))
             
             # Map back to global indices
             global_indices = [cluster['original_indices'][idx] for idx in route_local_indices]
@@ -134,11 +236,14 @@ async def optimize(
                 centroid=cluster['centroid']
             ))
 
-        # Recalculate Total Distance of the FINAL route to include inter-cluster travel
-        full_dist_matrix = tsp_service._precompute_distance_matrix(coords)
-        total_distance = tsp_service.calculate_total_distance(full_dist_matrix, final_route_indices)
+        # Recalculate Total Distance of the FINAL route to include inter-cluster travel.
+        # Road totals sum the route's own edges, straight-line ones are
+        # haversine (ellipsoidal with metric='geodesic'), whatever
+        # approximation the solvers used.
+        total_distance = tsp_service.calculate_metric_route_distance(coords, final_route_indices)
         
         tsp_time = time.time() - tsp_start
+        cache_after = tsp_cache.get_stats()
 
         # Build response
         route_coords = coords[final_route_indices].tolist()
@@ -155,7 +260,18 @@ async def optimize(
                 clustering_time=clustering_time,
                 tsp_time=tsp_time,
                 n_points=len(coords),
-                n_clusters=n_clusters
+                n_clusters=n_clusters,
+                warning=' '.join(solver_warnings) or None,
+                timed_out=timed_out,
+                cache_hits=cache_after['hits'] - cache_before['hits'],
+                cache_misses=cache_after['misses'] - cache_before['misses'],
+                metric=metric,
+                metric_max_rel_error=metric_error,
+                clustering_backend=clustering_backend,
+                clustering_inertia=clustering_stats.get('inertia', 0.0),
+                n_clusters_auto=cluster_service.auto,
+                predicted_tsp_time=clustering_stats.get('predicted_tsp_time'),
+                clustering_registry=clustering_stats.get('registry')
             )
         )
 
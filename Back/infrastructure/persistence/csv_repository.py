@@ -1,11 +1,15 @@
 import pandas as pd
 import numpy as np
-from typing import Tuple, List, Optional
+from typing import Tuple, List, Optional, Iterator
 from datetime import datetime
 import os
 
+from domain.services.spatial_index import hilbert_order
+
 class CSVRepository:
     _df_cache = None
+    _cols_to_use = ['CODIGO_RUTA', 'DEPARTAMENTO', 'PROVINCIA', 'FECHA_CORTE']
+    _encodings = ['latin1', 'iso-8859-1', 'cp1252']
 
     def __init__(self, csv_path: str = '1_Dataset_Intervenciones_PVD_30062025.csv'):
         # Adjust path to be relative to the Back directory if needed, or absolute
@@ -38,27 +42,132 @@ class CSVRepository:
             'MADRE DE DIOS': (-12.5931, -69.1891),
         }
 
-    def load_data(self, date_filter: Optional[str] = None, max_points: int = 50) -> Tuple[np.ndarray, List[str]]:
+    @staticmethod
+    def _spatial_sort(coords: np.ndarray, names: List[str]) -> Tuple[np.ndarray, List[str]]:
+        # Hilbert curve order: later stages get spatially coherent input
+        order = hilbert_order(coords)
+        return coords[order], [names[i] for i in order]
+
+    def _resolve_path(self):
+        if not os.path.exists(self.csv_path):
+            # Try looking one level up or in current dir
+            if os.path.exists(os.path.join('..', self.csv_path)):
+                self.csv_path = os.path.join('..', self.csv_path)
+            elif os.path.exists(os.path.join('Back', self.csv_path)):
+                self.csv_path = os.path.join('Back', self.csv_path)
+            else:
+                 # Fallback to absolute path if possible or raise error
+                 pass
+
+    @staticmethod
+    def _route_jitter(codes: pd.Series) -> np.ndarray:
+        # +-0.3 degree (lat, lon) offset derived from the route code alone, so
+        # a route lands on the same point whichever rows come before it: the
+        # high and low 32 bits of a fixed-key hash of the code
+        h = pd.util.hash_pandas_object(codes.astype(str), index=False).to_numpy()
+        unit = np.column_stack((h >> np.uint64(32), h & np.uint64(0xFFFFFFFF))) / 2.0 ** 32
+        return (unit - 0.5) * 0.6
+
+    def _rows_to_points(self, rows: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
+        # Department centre plus the route's jitter; routes with an unknown
+        # department are skipped
+        dept = rows['DEPARTAMENTO'].fillna('').astype(str).str.strip().str.upper()
+        dept = dept.str.split('-').str[0].str.strip()
+        known = dept.isin(list(self.coords_departamentos)).to_numpy()
+        rows, dept = rows[known], dept[known]
+        if len(rows) == 0:
+            return np.empty((0, 2)), []
+
+        base = np.array([self.coords_departamentos[d] for d in dept])
+        coords = base + self._route_jitter(rows['CODIGO_RUTA'])
+        if 'PROVINCIA' in rows:
+            provincia = rows['PROVINCIA'].astype(str)
+        else:
+            provincia = pd.Series('Desconocida', index=rows.index)
+        names = (rows['CODIGO_RUTA'].astype(str) + '_' + provincia.str[:15]).tolist()
+        return coords, names
+
+    def iter_chunks(self, date_filter: Optional[str] = None, chunk_size: int = 10000,
+                    max_points: Optional[int] = None) -> Iterator[Tuple[np.ndarray, List[str]]]:
+        # Same routes and points as load_data, in the same order, streamed:
+        # the CSV is read chunk_size rows at a time and the new routes of each
+        # chunk are yielded as (coords, names) right away, remembering only
+        # the route codes already seen. load_data keeps the first row of each
+        # route after a stable sort by FECHA_CORTE, so without a date filter
+        # the file is read once per date, oldest first (after a pass over the
+        # FECHA_CORTE column alone to find the dates). Reading stops once
+        # max_points routes are taken (None for all).
+        self._resolve_path()
+        encoding = None
+        for candidate in self._encodings:
+            try:
+                pd.read_csv(self.csv_path, sep=';', encoding=candidate, usecols=self._cols_to_use,
+                            dtype=str, nrows=5)
+                encoding = candidate
+                break
+            except Exception:
+                continue
+        if encoding is None:
+            raise ValueError("Could not load CSV file")
+
+        def read(columns):
+            return pd.read_csv(self.csv_path, sep=';', encoding=encoding, usecols=columns,
+                               dtype=str, chunksize=chunk_size)
+
+        if date_filter:
+            dates = [str(date_filter).replace('-', '')]
+        else:
+            dates = set()
+            missing = False
+            for chunk in read(['FECHA_CORTE']):
+                fecha = chunk['FECHA_CORTE'].astype(str).str.strip()
+                dates.update(fecha.dropna())
+                missing = missing or bool(fecha.isna().any())
+            # Rows without a date sort last, and a None pass reads them
+            dates = sorted(dates) + ([None] if missing else [])
+
+        seen = set()
+        n_points = 0
+        for date_str in dates:
+            for chunk in read(self._cols_to_use):
+                fecha = chunk['FECHA_CORTE'].astype(str).str.strip()
+                chunk = chunk[fecha.isna() if date_str is None else fecha == date_str]
+                chunk = chunk.drop_duplicates(subset=['CODIGO_RUTA'])
+                chunk = chunk[~chunk['CODIGO_RUTA'].isin(seen)]
+                if max_points is not None:
+                    # Truncated before the unknown departments are dropped, as load_data does
+                    chunk = chunk.head(max_points - len(seen))
+                seen.update(chunk['CODIGO_RUTA'])
+                coords, names = self._rows_to_points(chunk)
+                if len(names) > 0:
+                    n_points += len(names)
+                    yield coords, names
+                if max_points is not None and len(seen) >= max_points:
+                    return
+
+        if not seen:
+            if date_filter:
+                raise ValueError(f"No data found for date {date_filter}")
+            raise ValueError("No valid coordinates found in CSV")
+        if n_points == 0:
+            if date_filter:
+                raise ValueError(f"No valid coordinates found for date {date_filter}")
+            raise ValueError("No valid coordinates found in CSV")
+
+    def load_data(self, date_filter: Optional[str] = None, max_points: Optional[int] = 50,
+                  spatial_sort: bool = False) -> Tuple[np.ndarray, List[str]]:
+        # max_points=None loads every route
         if CSVRepository._df_cache is not None:
             df = CSVRepository._df_cache.copy()
         else:
-            if not os.path.exists(self.csv_path):
-                # Try looking one level up or in current dir
-                if os.path.exists(os.path.join('..', self.csv_path)):
-                    self.csv_path = os.path.join('..', self.csv_path)
-                elif os.path.exists(os.path.join('Back', self.csv_path)):
-                    self.csv_path = os.path.join('Back', self.csv_path)
-                else:
-                     # Fallback to absolute path if possible or raise error
-                     pass
+            self._resolve_path()
 
             df = None
-            cols_to_use = ['CODIGO_RUTA', 'DEPARTAMENTO', 'PROVINCIA', 'FECHA_CORTE']
             
-            for encoding in ['latin1', 'iso-8859-1', 'cp1252']:
+            for encoding in self._encodings:
                 try:
                     # Read all rows first to filter
-                    df = pd.read_csv(self.csv_path, sep=';', encoding=encoding, usecols=cols_to_use, dtype=str)
+                    df = pd.read_csv(self.csv_path, sep=';', encoding=encoding, usecols=self._cols_to_use, dtype=str)
                     break
                 except Exception:
                     continue
@@ -70,7 +179,8 @@ class CSVRepository:
             # Ensure FECHA_CORTE is string and strip whitespace
             df['FECHA_CORTE'] = df['FECHA_CORTE'].astype(str).str.strip()
             # Sort by FECHA_CORTE for faster access
-            df.sort_values('FECHA_CORTE', inplace=True)
+            # (stable, so ties keep file order and iter_chunks can match it)
+            df.sort_values('FECHA_CORTE', kind='stable', inplace=True)
             
             CSVRepository._df_cache = df.copy()
 
@@ -89,43 +199,25 @@ class CSVRepository:
 
         # Unique routes
         # head(max_points) optimization: take only what we need immediately
-        rutas_unicas = df_working.drop_duplicates(subset=['CODIGO_RUTA']).head(max_points)
-        
-        coordenadas_list = []
-        nombres_list = []
+        rutas_unicas = df_working.drop_duplicates(subset=['CODIGO_RUTA'])
+        if max_points is not None:
+            rutas_unicas = rutas_unicas.head(max_points)
         
-        np.random.seed(42)
-
-        for _, row in rutas_unicas.iterrows():
-            try:
-                codigo_ruta = str(row['CODIGO_RUTA'])
-                dept_raw = str(row['DEPARTAMENTO'])
-                provincia = str(row.get('PROVINCIA', 'Desconocida'))
-
-                dept = dept_raw.strip().upper()
-                if '-' in dept:
-                    dept = dept.split('-')[0].strip()
-
-                if dept in self.coords_departamentos:
-                    base_lat, base_lon = self.coords_departamentos[dept]
-                    lat = base_lat + np.random.uniform(-0.3, 0.3)
-                    lon = base_lon + np.random.uniform(-0.3, 0.3)
-                    
-                    coordenadas_list.append([lat, lon])
-                    nombres_list.append(f"{codigo_ruta}_{provincia[:15]}")
-            except Exception:
-                continue
+        coordenadas, nombres_list = self._rows_to_points(rutas_unicas)
                 
-        if not coordenadas_list:
+        if not nombres_list:
              # Fallback if filtering resulted in empty but we need data for demo?
              # Or just raise error
              if date_filter:
                  raise ValueError(f"No valid coordinates found for date {date_filter}")
              raise ValueError("No valid coordinates found in CSV")
 
-        return np.array(coordenadas_list), nombres_list
+        if spatial_sort:
+            return self._spatial_sort(coordenadas, nombres_list)
+        return coordenadas, nombres_list
 
-    def load_from_excel(self, file_content: bytes, max_points: int = 100) -> Tuple[np.ndarray, List[str]]:
+    def load_from_excel(self, file_content: bytes, max_points: int = 100,
+                        spatial_sort: bool = False) -> Tuple[np.ndarray, List[str]]:
         # This would require saving bytes to temp file or using BytesIO
         import io
         df = pd.read_excel(io.BytesIO(file_content))
@@ -142,4 +234,6 @@ class CSVRepository:
             
         coords = df[['Latitud', 'Longitud']].values
         names = df['Nombre'].astype(str).tolist()
+        if spatial_sort:
+            return self._spatial_sort(coords, names)
         return coords, names
@@ -0,0 +1,74 @@
+import pandas as pd
+import numpy as np
+from typing import Dict, Tuple
+import os
+
+from domain.models.road_graph import RoadGraph
+
+class RoadNetworkRepository:
+    # Loaded graphs by (edges_path, nodes_path), parsing a country-size
+    # edge list takes far longer than a request
+    _graph_cache: Dict[Tuple[str, str], RoadGraph] = {}
+
+    def __init__(self, edges_path: str, nodes_path: str):
+        # edges: source, target, length_km (one row per road segment, both ways)
+        # nodes: node_id, lat, lon
+        # Either file can be .csv or .parquet
+        self.edges_path = edges_path
+        self.nodes_path = nodes_path
+
+    @staticmethod
+    def _read_table(path: str, columns) -> pd.DataFrame:
+        if not os.path.exists(path):
+            raise ValueError(f"Road network file not found: {path}")
+        if path.endswith('.parquet'):
+            df = pd.read_parquet(path, columns=columns)
+        else:
+            df = pd.read_csv(path, usecols=columns)
+        return df
+
+    def load(self) -> RoadGraph:
+        key = (self.edges_path, self.nodes_path)
+        if key in RoadNetworkRepository._graph_cache:
+            return RoadNetworkRepository._graph_cache[key]
+
+        nodes = self._read_table(self.nodes_path, ['node_id', 'lat', 'lon'])
+        edges = self._read_table(self.edges_path, ['source', 'target', 'length_km'])
+        nodes = nodes.dropna().drop_duplicates('node_id').sort_values('node_id')
+        node_ids = nodes['node_id'].to_numpy()
+        if len(node_ids) == 0:
+            raise ValueError(f"Road network has no nodes: {self.nodes_path}")
+
+        # Node ids -> 0..n-1; edges touching unknown nodes are dropped
+        src = np.searchsorted(node_ids, edges['source'].to_numpy())
+        dst = np.searchsorted(node_ids, edges['target'].to_numpy())
+        src = np.minimum(src, len(node_ids) - 1)
+        dst = np.minimum(dst, len(node_ids) - 1)
+        length = edges['length_km'].to_numpy(dtype=np.float64)
+        valid = ((node_ids[src] == edges['source'].to_numpy())
+                 & (node_ids[dst] == edges['target'].to_numpy())
+                 & (src != dst) & np.isfinite(length) & (length >= 0))
+        src, dst, length = src[valid], dst[valid], length[valid]
+
+        # Store both directions, keep the shortest of parallel edges
+        rows = np.concatenate([src, dst])
+        cols = np.concatenate([dst, src])
+        weights = np.concatenate([length, length])
+        order = np.lexsort((weights, cols, rows))
+        rows, cols, weights = rows[order], cols[order], weights[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, weights = rows[first], cols[first], weights[first]
+
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(node_ids)), out=indptr[1:])
+
+        graph = RoadGraph(
+            node_ids=node_ids,
+            node_coords=nodes[['lat', 'lon']].to_numpy(dtype=np.float64),
+            indptr=indptr,
+            indices=cols.astype(np.int32),
+            weights=weights,
+        )
+        RoadNetworkRepository._graph_cache[key] = graph
+        return graph
@@ -4,14 +4,16 @@ import time
 import json
 
 from kmeans_clustering import KMeansClusterer
-from tsp_algorithms import resolver_tsp, calcular_distancia
+from tsp_algorithms import resolver_tsp, calcular_distancias_pares
 
 
 class OptimizadorRutasHibrido:
 
-    def __init__(self, n_clusters: int = 5, random_state: int = 42):
+    def __init__(self, n_clusters: int = 5, random_state: int = 42, metrica: str = 'euclidiana'):
         self.n_clusters = n_clusters
         self.random_state = random_state
+        # 'euclidiana' (grados) o 'haversine' (km), ver resolver_tsp
+        self.metrica = metrica
         self.clusterer = KMeansClusterer(n_clusters, random_state)
         self.resultados = None
 
@@ -64,7 +66,7 @@ class OptimizadorRutasHibrido:
             else:
                 # Resolver TSP - FORZAR EL MÉTODO SELECCIONADO
                 print(f"    Método solicitado: {metodo_tsp}")
-                ruta_local, distancia, stats_tsp = resolver_tsp(coords_cluster, metodo_tsp)
+                ruta_local, distancia, stats_tsp = resolver_tsp(coords_cluster, metodo_tsp, self.metrica)
                 tiempo_total_tsp += stats_tsp['tiempo']
 
                 # Contar método usado
@@ -109,29 +111,28 @@ class OptimizadorRutasHibrido:
             ruta_global_final.extend(cluster_result['ruta_global'])
             distancia_total += cluster_result['distancia']
 
-        # Calcular distancias entre clusters
-        for i in range(len(orden_clusters) - 1):
-            idx_actual = orden_clusters[i]
-            idx_siguiente = orden_clusters[i + 1]
-
-            # Último punto del cluster actual
-            ultimo_punto_actual = resultados_clusters[idx_actual]['ruta_global'][-1]
-            # Primer punto del siguiente cluster
-            primer_punto_siguiente = resultados_clusters[idx_siguiente]['ruta_global'][0]
-
-            dist = calcular_distancia(
-                coordenadas[ultimo_punto_actual],
-                coordenadas[primer_punto_siguiente]
-            )
-            distancia_entre_clusters += dist
+        # Calcular distancias entre clusters: último punto del cluster actual
+        # -> primer punto del siguiente, todas las parejas en una sola llamada
+        origenes = [resultados_clusters[orden_clusters[i]]['ruta_global'][-1]
+                    for i in range(len(orden_clusters) - 1)]
+        destinos = [resultados_clusters[orden_clusters[i + 1]]['ruta_global'][0]
+                    for i in range(len(orden_clusters) - 1)]
 
         # Distancia de regreso al inicio
         if len(ruta_global_final) > 0:
-            dist_regreso = calcular_distancia(
-                coordenadas[ruta_global_final[-1]],
-                coordenadas[ruta_global_final[0]]
+            origenes.append(ruta_global_final[-1])
+            destinos.append(ruta_global_final[0])
+
+        if origenes:
+            coordenadas_np = np.asarray(coordenadas)
+            distancias_pares = calcular_distancias_pares(
+                coordenadas_np[origenes],
+                coordenadas_np[destinos],
+                self.metrica
             )
-            distancia_entre_clusters += dist_regreso
+            # Suma en el mismo orden que antes
+            for dist in distancias_pares:
+                distancia_entre_clusters += dist
 
         distancia_total += distancia_entre_clusters
 
@@ -0,0 +1,73 @@
+import numpy as np
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from domain.services.clustering_service import ClusteringService
+from domain.services.clustering_registry import KMeansRegistry
+
+
+def _puntos(n, seed):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(-12.2, -11.75, n), rng.uniform(-77.2, -76.75, n)))
+
+
+def test_repeticion_reutiliza_etiquetas():
+    registro = KMeansRegistry()
+    coords = _puntos(2000, 0)
+    primero = ClusteringService(n_clusters=8, registry=registro).fit(coords)
+    segundo = ClusteringService(n_clusters=8, registry=registro).fit(coords.copy())
+
+    assert (primero.registry_status, segundo.registry_status) == ('miss', 'hit')
+    assert (primero.labels_ == segundo.labels_).all()
+
+
+def test_arranque_en_caliente_respeta_el_tope():
+    # El conjunto parecido necesita mas clusters de los que tenia el registrado
+    registro = KMeansRegistry()
+    coords = _puntos(360, 1)
+    ClusteringService(n_clusters=20, max_cluster_size=18, registry=registro).fit(coords)
+    parecido = np.vstack((coords, _puntos(10, 2)))
+    servicio = ClusteringService(n_clusters=20, max_cluster_size=18, registry=registro).fit(parecido)
+
+    assert servicio.registry_status == 'warm'
+    assert servicio.n_clusters == 21
+    assert np.bincount(servicio.labels_).max() <= 18
+
+
+def test_auto_en_caliente_respeta_el_tope():
+    registro = KMeansRegistry()
+    coords = _puntos(360, 1)
+    registrado = ClusteringService(n_clusters=20, max_cluster_size=18).fit(coords)
+    # Resultado de 'auto' con k=20 para 360 puntos, justo en el tope
+    servicio = ClusteringService(n_clusters='auto', max_cluster_size=18, registry=registro)
+    registro.store(coords, servicio._registry_config(), registrado._result())
+
+    servicio.fit(np.vstack((coords, _puntos(10, 2))))
+    assert servicio.registry_status == 'warm'
+    assert servicio.n_clusters >= 21
+    assert np.bincount(servicio.labels_).max() <= 18
+
+
+def test_capacidad_insuficiente():
+    coords = _puntos(50, 3)
+    with pytest.raises(ValueError, match='cannot hold'):
+        ClusteringService._capacitated_assignment(coords, coords[:2], 10)
+
+
+def test_arranque_en_caliente_con_menos_clusters():
+    # El registrado necesitó más clusters por el tope; el parecido, con el
+    # tope ya cubierto por k, arranca de los centroides más poblados
+    registro = KMeansRegistry()
+    coords = _puntos(400, 4)
+    anterior = ClusteringService(n_clusters=20, max_cluster_size=18, registry=registro).fit(coords)
+    assert anterior.n_clusters == 23
+    parecido = coords[:380]
+    servicio = ClusteringService(n_clusters=20, max_cluster_size=18, registry=registro).fit(parecido)
+
+    assert servicio.registry_status == 'warm'
+    assert servicio.n_clusters == 22
+    assert np.bincount(servicio.labels_).max() <= 18
@@ -0,0 +1,35 @@
+import numpy as np
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from infrastructure.persistence.csv_repository import CSVRepository
+
+CSV = os.path.join(os.path.dirname(__file__), '1_Dataset_Intervenciones_PVD_30062025.csv')
+
+
+@pytest.mark.parametrize('max_points, fecha, bloque', [
+    (50, None, 1000),
+    (None, None, 700),
+    (200, '2024-12-31', 300),
+    (700, None, 250),
+])
+def test_lectura_por_bloques_igual_a_carga_completa(max_points, fecha, bloque):
+    # Cambiar de backend de clustering no debe cambiar los puntos agrupados
+    repo = CSVRepository(CSV)
+    coords, nombres = repo.load_data(date_filter=fecha, max_points=max_points)
+    bloques = list(repo.iter_chunks(date_filter=fecha, max_points=max_points, chunk_size=bloque))
+
+    assert sum((n for _, n in bloques), []) == nombres
+    assert np.array_equal(np.vstack([c for c, _ in bloques]), coords)
+
+
+def test_desplazamiento_fijo_por_ruta():
+    repo = CSVRepository(CSV)
+    coords, nombres = repo.load_data(max_points=None)
+    pocas, pocos_nombres = repo.load_data(max_points=20)
+    posicion = {nombre: i for i, nombre in enumerate(nombres)}
+    assert np.array_equal(coords[[posicion[n] for n in pocos_nombres]], pocas)
@@ -0,0 +1,46 @@
+import numpy as np
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from domain.services.tsp_service import TSPService
+
+
+def _puntos(n, seed):
+    # Puntos aleatorios en un cuadrado de ~50 km alrededor de Lima
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(-12.2, -11.75, n), rng.uniform(-77.2, -76.75, n)))
+
+
+def _longitud(servicio, coords, ruta):
+    return servicio.calculate_total_distance(servicio.get_distance_matrix(coords), ruta)
+
+
+@pytest.mark.parametrize('n, seed', [(8, 0), (10, 1), (12, 2), (12, 11), (13, 0), (14, 6)])
+@pytest.mark.parametrize('metodo', ['backtracking', 'parallel_backtracking'])
+def test_exactos_igualan_held_karp(metodo, n, seed):
+    servicio = TSPService(n_workers=4)
+    coords = _puntos(n, seed)
+    _, optimo, _ = servicio.solve(coords, 'held_karp')
+    ruta, distancia, stats = servicio.solve(coords, metodo)
+
+    assert sorted(ruta) == list(range(n))
+    assert not stats['timed_out']
+    assert distancia == pytest.approx(optimo, rel=1e-9)
+    # La distancia informada es la de la ruta devuelta
+    assert _longitud(servicio, coords, ruta) == pytest.approx(distancia, rel=1e-9)
+
+
+@pytest.mark.parametrize('n, seed', [(12, 2), (16, 0), (18, 4), (19, 1), (19, 5)])
+def test_branch_and_bound_iguala_held_karp(n, seed):
+    servicio = TSPService()
+    coords = _puntos(n, seed)
+    _, optimo, _ = servicio.solve(coords, 'held_karp')
+    ruta, distancia, stats = servicio.solve(coords, 'branch_and_bound')
+
+    assert sorted(ruta) == list(range(n))
+    assert not stats['timed_out']
+    assert distancia == pytest.approx(optimo, rel=1e-9)
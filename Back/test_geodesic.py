@@ -0,0 +1,63 @@
+import numpy as np
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from geopy.distance import geodesic
+
+from domain.services.distance_matrix import CondensedDistanceMatrix
+from domain.services.geodesic import geodesic_distances, geodesic_matrix, route_length
+from domain.services.tsp_service import TSPService
+
+
+def _pares(n_pares, seed):
+    # Mitad dentro del Peru, mitad en cualquier parte del globo, con algunos
+    # pares casi antipodales donde Vincenty necesita el respaldo de geopy
+    rng = np.random.default_rng(seed)
+    mitad = n_pares // 2
+    local = np.column_stack((rng.uniform(-18.5, 0.0, mitad), rng.uniform(-81.5, -68.5, mitad)))
+    local2 = np.column_stack((rng.uniform(-18.5, 0.0, mitad), rng.uniform(-81.5, -68.5, mitad)))
+    resto = n_pares - mitad
+    mundo = np.column_stack((rng.uniform(-89.9, 89.9, resto), rng.uniform(-180, 180, resto)))
+    mundo2 = np.column_stack((rng.uniform(-89.9, 89.9, resto), rng.uniform(-180, 180, resto)))
+    mundo2[:10] = np.column_stack((-mundo[:10, 0] + 0.01, mundo[:10, 1] - 179.7))
+    return np.vstack((local, mundo)), np.vstack((local2, mundo2))
+
+
+def test_error_frente_a_karney():
+    p1, p2 = _pares(2000, 0)
+    nuestro = geodesic_distances(p1, p2)
+    referencia = np.array([geodesic(a, b).kilometers for a, b in zip(p1, p2)])
+    error = np.abs(nuestro - referencia)
+
+    # Menos de 1 mm en valor absoluto y 1e-9 relativo
+    assert error.max() * 1000.0 < 1e-3
+    assert np.max(error / np.maximum(referencia, 1e-12)) < 1e-9
+
+
+def test_matriz_y_ruta_coherentes():
+    rng = np.random.default_rng(1)
+    coords = np.column_stack((rng.uniform(-12.2, -11.75, 30), rng.uniform(-77.2, -76.75, 30)))
+    matriz = geodesic_matrix(coords, block_size=64)
+    ruta = list(range(30))
+
+    assert np.allclose(matriz, matriz.T)
+    assert np.all(np.diag(matriz) == 0)
+    assert matriz[3, 17] == pytest.approx(geodesic(coords[3], coords[17]).kilometers, abs=1e-6)
+    assert route_length(coords, ruta) == pytest.approx(
+        sum(matriz[ruta[i - 1], ruta[i]] for i in range(30)), rel=1e-12)
+
+
+def test_matriz_condensada_igual_a_la_densa():
+    # La condensada se llena por bloques de filas sin pasar por la densa
+    rng = np.random.default_rng(2)
+    coords = np.column_stack((rng.uniform(-12.2, -11.75, 40), rng.uniform(-77.2, -76.75, 40)))
+    servicio = TSPService(metric='geodesic', condensed_min_points=2)
+    condensada = servicio.get_distance_matrix(coords)
+
+    assert isinstance(condensada, CondensedDistanceMatrix)
+    densa = CondensedDistanceMatrix.from_dense(geodesic_matrix(coords))
+    assert np.array_equal(condensada.values, densa.values)
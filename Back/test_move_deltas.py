@@ -0,0 +1,70 @@
+import numpy as np
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from domain.services.tsp_service import TSPService
+
+
+def _matriz(n, seed):
+    # Simetrica con diagonal cero, como las que ven los solvers
+    rng = np.random.default_rng(seed)
+    m = rng.uniform(1.0, 100.0, (n, n))
+    m = (m + m.T) / 2
+    np.fill_diagonal(m, 0.0)
+    return m
+
+
+def _ruta(n, seed):
+    return np.random.default_rng(seed + 1000).permutation(n).tolist()
+
+
+def _intercambiar(ruta, i, j):
+    nueva = list(ruta)
+    nueva[i], nueva[j] = nueva[j], nueva[i]
+    return nueva
+
+
+def _invertir(ruta, i, j):
+    i, j = min(i, j), max(i, j)
+    return ruta[:i + 1] + ruta[i + 1:j + 1][::-1] + ruta[j + 1:]
+
+
+def _reubicar(ruta, i, j):
+    # El nodo de la posicion i pasa a ir justo despues de ruta[j]
+    v, destino = ruta[i], ruta[j]
+    nueva = [u for u in ruta if u != v]
+    k = nueva.index(destino)
+    return nueva[:k + 1] + [v] + nueva[k + 1:]
+
+
+# Todos los pares (i, j), incluidos los adyacentes, los que cruzan el
+# cierre del tour (0 con n - 1) y i > j
+@pytest.mark.parametrize("n", [3, 4, 5, 6, 9])
+@pytest.mark.parametrize("delta, mover", [
+    (TSPService.swap_delta, _intercambiar),
+    (TSPService.two_opt_delta, _invertir),
+    (TSPService.relocate_delta, _reubicar),
+])
+def test_delta_igual_a_recalcular(n, delta, mover):
+    for seed in range(3):
+        matriz = _matriz(n, seed)
+        ruta = _ruta(n, seed)
+        base = TSPService.calculate_total_distance(matriz, ruta)
+        for i in range(n):
+            for j in range(n):
+                if i == j:
+                    continue
+                esperado = TSPService.calculate_total_distance(matriz, mover(ruta, i, j)) - base
+                assert delta(matriz, ruta, i, j) == pytest.approx(esperado, abs=1e-9), (i, j, ruta)
+
+
+def test_distancias_por_lotes():
+    matriz = _matriz(8, 0)
+    rutas = np.array([_ruta(8, seed) for seed in range(20)])
+    lotes = TSPService.calculate_total_distances(matriz, rutas)
+    uno_a_uno = [TSPService.calculate_total_distance(matriz, ruta) for ruta in rutas]
+    assert lotes == pytest.approx(uno_a_uno)
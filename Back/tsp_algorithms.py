@@ -1,9 +1,12 @@
 
 
 import numpy as np
-from itertools import permutations
+from itertools import permutations, islice
 import time
-from typing import List, Tuple
+from typing import List, Tuple, Optional
+from scipy.spatial.distance import cdist
+
+from domain.services.spatial_index import to_unit_vectors, chord_to_km
 
 
 def calcular_distancia(coord1: np.ndarray, coord2: np.ndarray) -> float:
@@ -11,19 +14,62 @@ def calcular_distancia(coord1: np.ndarray, coord2: np.ndarray) -> float:
     return np.linalg.norm(coord1 - coord2)
 
 
-def calcular_distancia_total(coordenadas: np.ndarray, ruta: List[int]) -> float:
+def calcular_distancias_pares(
+    origenes: np.ndarray,
+    destinos: np.ndarray,
+    metrica: str = 'euclidiana'
+) -> np.ndarray:
+
+    origenes = np.asarray(origenes, dtype=np.float64)
+    destinos = np.asarray(destinos, dtype=np.float64)
+    if metrica == 'haversine':
+        # Kilómetros sobre la esfera
+        u, v = to_unit_vectors(origenes), to_unit_vectors(destinos)
+        return chord_to_km(np.sqrt(np.sum((u - v) ** 2, axis=-1)))
+    if metrica != 'euclidiana':
+        raise ValueError(f"Métrica desconocida: {metrica}")
+    # Mismo producto punto que np.linalg.norm: resultados idénticos bit a bit
+    # a calcular_distancia
+    diff = origenes - destinos
+    return np.sqrt(np.matmul(diff[..., np.newaxis, :], diff[..., :, np.newaxis])[..., 0, 0])
+
+
+def calcular_matriz_distancias(
+    coordenadas: np.ndarray,
+    metrica: str = 'euclidiana',
+    filas_por_bloque: int = 256
+) -> np.ndarray:
+
+    # Matriz completa calculada una sola vez, por bloques de filas
+    coordenadas = np.asarray(coordenadas, dtype=np.float64)
+    n = len(coordenadas)
+    if metrica == 'haversine':
+        puntos = to_unit_vectors(coordenadas)
+        return chord_to_km(cdist(puntos, puntos))
+    matriz = np.empty((n, n))
+    for inicio in range(0, n, filas_por_bloque):
+        fin = min(inicio + filas_por_bloque, n)
+        matriz[inicio:fin] = calcular_distancias_pares(
+            coordenadas[inicio:fin, np.newaxis, :],
+            coordenadas[np.newaxis, :, :],
+            metrica
+        )
+    return matriz
+
+
+def calcular_distancia_total(
+    coordenadas: np.ndarray,
+    ruta: List[int],
+    matriz: Optional[np.ndarray] = None
+) -> float:
 
+    if matriz is None:
+        matriz = calcular_matriz_distancias(coordenadas)
     distancia = 0
     for i in range(len(ruta) - 1):
-        distancia += calcular_distancia(
-            coordenadas[ruta[i]],
-            coordenadas[ruta[i + 1]]
-        )
+        distancia += matriz[ruta[i], ruta[i + 1]]
     # Regresar al inicio
-    distancia += calcular_distancia(
-        coordenadas[ruta[-1]],
-        coordenadas[ruta[0]]
-    )
+    distancia += matriz[ruta[-1], ruta[0]]
     return distancia
 
 
@@ -36,7 +82,11 @@ class TSPFuerzaBruta:
         self.tiempo_ejecucion = 0
         self.permutaciones_evaluadas = 0
 
-    def resolver(self, coordenadas: np.ndarray) -> Tuple[List[int], float]:
+    def resolver(
+        self,
+        coordenadas: np.ndarray,
+        matriz: Optional[np.ndarray] = None
+    ) -> Tuple[List[int], float]:
 
         n = len(coordenadas)
 
@@ -45,6 +95,9 @@ class TSPFuerzaBruta:
 
         inicio = time.time()
 
+        if matriz is None:
+            matriz = calcular_matriz_distancias(coordenadas)
+
         # Generar todas las permutaciones (excepto el punto inicial)
         puntos = list(range(n))
         inicio_fijo = puntos[0]
@@ -54,16 +107,27 @@ class TSPFuerzaBruta:
         self.mejor_ruta = None
         self.permutaciones_evaluadas = 0
 
-        # Probar todas las permutaciones
-        for perm in permutations(resto):
-            ruta = [inicio_fijo] + list(perm)
-            distancia = calcular_distancia_total(coordenadas, ruta)
-
-            self.permutaciones_evaluadas += 1
-
-            if distancia < self.mejor_distancia:
-                self.mejor_distancia = distancia
-                self.mejor_ruta = ruta
+        # Probar todas las permutaciones, por lotes. Cada ruta se suma arista
+        # por arista en el mismo orden que calcular_distancia_total, así que
+        # las distancias (y los empates) son idénticos
+        perms = permutations(resto)
+        while True:
+            bloque = list(islice(perms, 4096))
+            if not bloque:
+                break
+            lote = np.array(bloque, dtype=np.int64).reshape(len(bloque), n - 1)
+            rutas = np.column_stack((np.full(len(lote), inicio_fijo), lote))
+            distancias = np.zeros(len(rutas))
+            for i in range(n - 1):
+                distancias += matriz[rutas[:, i], rutas[:, i + 1]]
+            distancias += matriz[rutas[:, -1], rutas[:, 0]]
+
+            self.permutaciones_evaluadas += len(rutas)
+
+            mejor = int(np.argmin(distancias))
+            if distancias[mejor] < self.mejor_distancia:
+                self.mejor_distancia = distancias[mejor]
+                self.mejor_ruta = rutas[mejor].tolist()
 
         self.tiempo_ejecucion = time.time() - inicio
 
@@ -80,7 +144,11 @@ class TSPBacktracking:
         self.nodos_explorados = 0
         self.podas_realizadas = 0
 
-    def resolver(self, coordenadas: np.ndarray) -> Tuple[List[int], float]:
+    def resolver(
+        self,
+        coordenadas: np.ndarray,
+        matriz: Optional[np.ndarray] = None
+    ) -> Tuple[List[int], float]:
 
         n = len(coordenadas)
 
@@ -89,6 +157,11 @@ class TSPBacktracking:
 
         inicio = time.time()
 
+        if matriz is None:
+            matriz = calcular_matriz_distancias(coordenadas)
+        # Listas de Python: el acceso escalar es más rápido que en un ndarray
+        distancias = np.asarray(matriz).tolist()
+
         self.mejor_distancia = float('inf')
         self.mejor_ruta = None
         self.nodos_explorados = 0
@@ -99,7 +172,7 @@ class TSPBacktracking:
         ruta_actual = [0]
         visitados[0] = True
 
-        self._backtrack(coordenadas, visitados, ruta_actual, 0, n)
+        self._backtrack(distancias, visitados, ruta_actual, 0, n)
 
         self.tiempo_ejecucion = time.time() - inicio
 
@@ -107,7 +180,7 @@ class TSPBacktracking:
 
     def _backtrack(
         self,
-        coordenadas: np.ndarray,
+        distancias: List[List[float]],
         visitados: List[bool],
         ruta_actual: List[int],
         distancia_actual: float,
@@ -124,10 +197,7 @@ class TSPBacktracking:
         # Caso base: todos los nodos visitados
         if len(ruta_actual) == n:
             # Agregar distancia de regreso al inicio
-            distancia_total = distancia_actual + calcular_distancia(
-                coordenadas[ruta_actual[-1]],
-                coordenadas[ruta_actual[0]]
-            )
+            distancia_total = distancia_actual + distancias[ruta_actual[-1]][ruta_actual[0]]
 
             if distancia_total < self.mejor_distancia:
                 self.mejor_distancia = distancia_total
@@ -136,14 +206,12 @@ class TSPBacktracking:
 
         # Probar cada nodo no visitado
         ultimo = ruta_actual[-1]
+        fila = distancias[ultimo]
 
         for i in range(n):
             if not visitados[i]:
                 # Calcular distancia al próximo nodo
-                dist_adicional = calcular_distancia(
-                    coordenadas[ultimo],
-                    coordenadas[i]
-                )
+                dist_adicional = fila[i]
 
                 # Poda temprana
                 if distancia_actual + dist_adicional < self.mejor_distancia:
@@ -151,7 +219,7 @@ class TSPBacktracking:
                     ruta_actual.append(i)
 
                     self._backtrack(
-                        coordenadas,
+                        distancias,
                         visitados,
                         ruta_actual,
                         distancia_actual + dist_adicional,
@@ -173,12 +241,20 @@ class TSPVecinoMasCercano:
         self.distancia = 0
         self.tiempo_ejecucion = 0
 
-    def resolver(self, coordenadas: np.ndarray, inicio: int = 0) -> Tuple[List[int], float]:
+    def resolver(
+        self,
+        coordenadas: np.ndarray,
+        inicio: int = 0,
+        matriz: Optional[np.ndarray] = None
+    ) -> Tuple[List[int], float]:
 
         inicio_tiempo = time.time()
 
+        if matriz is None:
+            matriz = calcular_matriz_distancias(coordenadas)
+
         n = len(coordenadas)
-        visitados = [False] * n
+        visitados = np.zeros(n, dtype=bool)
         ruta = [inicio]
         visitados[inicio] = True
         distancia = 0
@@ -187,16 +263,13 @@ class TSPVecinoMasCercano:
 
         # Construir la ruta
         for _ in range(n - 1):
-            min_dist = float('inf')
-            siguiente = -1
-
-            # Encontrar el vecino más cercano no visitado
-            for i in range(n):
-                if not visitados[i]:
-                    dist = calcular_distancia(coordenadas[actual], coordenadas[i])
-                    if dist < min_dist:
-                        min_dist = dist
-                        siguiente = i
+            # Encontrar el vecino más cercano no visitado (el primero en caso
+            # de empate, como el recorrido fila por fila)
+            fila = np.where(visitados, np.inf, matriz[actual])
+            siguiente = int(np.argmin(fila))
+            min_dist = float(fila[siguiente])
+            if min_dist == float('inf'):
+                siguiente = -1
 
             if siguiente != -1:
                 ruta.append(siguiente)
@@ -205,7 +278,7 @@ class TSPVecinoMasCercano:
                 actual = siguiente
 
         # Regresar al inicio
-        distancia += calcular_distancia(coordenadas[actual], coordenadas[inicio])
+        distancia += matriz[actual][inicio]
 
         self.ruta = ruta
         self.distancia = distancia
@@ -226,13 +299,21 @@ def seleccionar_algoritmo_tsp(n_puntos: int) -> str:
 
 def resolver_tsp(
     coordenadas: np.ndarray,
-    metodo: str = 'auto'
+    metodo: str = 'auto',
+    metrica: str = 'euclidiana',
+    matriz: Optional[np.ndarray] = None
 ) -> Tuple[List[int], float, dict]:
 
+    # La matriz de distancias se calcula una sola vez para el solver elegido.
+    # 'euclidiana' (grados, por defecto) mantiene los resultados de siempre;
+    # 'haversine' da kilómetros. También se puede pasar una matriz ya hecha.
     n = len(coordenadas)
     metodo_original = metodo
     advertencia = None
 
+    if matriz is None:
+        matriz = calcular_matriz_distancias(coordenadas, metrica)
+
     # Selección automática solo si es 'auto'
     if metodo == 'auto':
         metodo = seleccionar_algoritmo_tsp(n)
@@ -246,7 +327,7 @@ def resolver_tsp(
     # Resolver según el método (FORZAR EL MÉTODO SELECCIONADO)
     if metodo == 'fuerza_bruta':
         solver = TSPFuerzaBruta()
-        ruta, distancia = solver.resolver(coordenadas)
+        ruta, distancia = solver.resolver(coordenadas, matriz=matriz)
         stats = {
             'metodo': 'fuerza_bruta',
             'metodo_seleccionado': metodo_original,
@@ -256,7 +337,7 @@ def resolver_tsp(
 
     elif metodo == 'backtracking':
         solver = TSPBacktracking()
-        ruta, distancia = solver.resolver(coordenadas)
+        ruta, distancia = solver.resolver(coordenadas, matriz=matriz)
         stats = {
             'metodo': 'backtracking',
             'metodo_seleccionado': metodo_original,
@@ -267,7 +348,7 @@ def resolver_tsp(
 
     else:  # vecino_cercano
         solver = TSPVecinoMasCercano()
-        ruta, distancia = solver.resolver(coordenadas)
+        ruta, distancia = solver.resolver(coordenadas, matriz=matriz)
         stats = {
             'metodo': 'vecino_cercano',
             'metodo_seleccionado': metodo_original,